@@ -1,22 +1,37 @@
 """
 The main page of the interactive dasboard.
 """
-import os
 import streamlit as st
-from project_code.main import setup
-from project_code.data_cleaning import load_indicator_data
-from project_code.visualization import plot_map
-
-if not os.path.exists("data/long"):
-    with st.spinner("Setting up data for the first time... This may take a minute."):
-        setup()
-    st.success("Data setup complete!")
+from project_code.main import background_setup
+from project_code.panel import snapshot_exists
+from project_code.catalog import indicator_label
+from project_code.data_cleaning import MAX_MISSING, load_indicator_data
+from project_code.visualization import plot_map, animated_map
+from project_code.instrumentation import start_rerun, timed, report_rerun
 
 st.set_page_config(
     page_title="The Wealth of Nations",
     layout="wide",
     page_icon="🗺️"
 )
+start_rerun()
+
+# The first setup runs in the background, visitors see a notice instead of
+# waiting for it and the dashboard loads once the snapshot is published
+if not snapshot_exists():
+    background_setup.start()
+
+    @st.fragment(run_every=5)
+    def wait_for_setup():
+        if snapshot_exists():
+            st.rerun()
+        elif background_setup.error is not None:
+            st.error(f"Data setup failed: {background_setup.error}")
+        else:
+            st.info("Setting up data for the first time... This may take a minute.")
+
+    wait_for_setup()
+    st.stop()
 
 # Streamlit app
 st.title("🗺️ The Wealth of Nations")
@@ -38,31 +53,56 @@ How might these relationships evolve over time? Explore the charts to uncover po
 the economy, environment, and well-being.
 """)
 
+# Let user choose how much missing data is allowed (kept for the other pages)
+max_missing = st.sidebar.slider(
+    "Maximum share of missing data",
+    min_value=0.1,
+    max_value=1.0,
+    value=st.session_state.get("max_missing", MAX_MISSING),
+    step=0.05,
+    help="Indicators and then countries with more missing years are left out.",
+)
+st.session_state["max_missing"] = max_missing
+
 # Load data
-data = load_indicator_data(rename_countries=False)
+with timed("data.load"):
+    data = load_indicator_data(rename_countries=False, max_missing=max_missing)
 
 # Let user select indicator
 indicators = list(data.keys())
 default_indicator = "life_expectancy"
-indicator_display_names = {name: name.replace("_", " ").title() for name in indicators}
+indicator_display_names = {name: indicator_label(name) for name in indicators}
 indicator = st.selectbox(
     "Select indicator", 
     options=indicators, 
     format_func=lambda x: indicator_display_names[x],
-    index=indicators.index(default_indicator)
+    index=indicators.index(default_indicator) if default_indicator in indicators else 0
     )
 
-# Drop NAs so the years with no data are not available
-for ind in data:
-    data[ind] = data[ind].dropna()
+# Let user play all years in the browser instead of choosing one
+animate = st.toggle("Animate over years", value=False)
 
-# and year
-year = st.slider(
-    "Select year",
-    min_value=min(data[indicator]["year"]),
-    max_value=max(data[indicator]["year"]),
-    value=max(data[indicator]["year"])  
-)
+if animate:
+    plot_chor_map = animated_map(data, indicator)
+else:
+    # Only the years with data are available (read from the metadata index
+    # of the loaded panel, no scan of the data)
+    metadata = data.metadata.loc[indicator]
+
+    # and year (no slider for indicators with data in one year only)
+    year = int(metadata["last_year"])
+    if metadata["first_year"] < metadata["last_year"]:
+        year = st.slider(
+            "Select year",
+            min_value=int(metadata["first_year"]),
+            max_value=year,
+            value=year
+        )
+    else:
+        st.markdown(f"Data available for {year} only.")
+
+    plot_chor_map = plot_map(data, indicator, year)
 
-plot_chor_map = plot_map(data, indicator, year)
 st.plotly_chart(plot_chor_map)
+
+report_rerun("global_overview")
@@ -0,0 +1,109 @@
+"""
+Import time of the dashboard pages: every page's imports are run in a fresh
+interpreter (a cold start of a worker), reported per imported package like
+python -X importtime, and checked against a startup budget. Exits with a
+non-zero status if a page is over the budget or loads a deferred dependency.
+
+Run from the project root:
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --budget 0.8 --top 15
+"""
+
+import argparse
+import ast
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+PAGES = [ROOT / "_🌍_Global_overview.py"] + sorted((ROOT / "pages").glob("*.py"))
+
+# Cold import of a page's modules, in seconds
+BUDGET_S = 1.0
+# Loaded by the functions using them, never when a page is imported
+DEFERRED = ["plotly.express", "scipy", "statsmodels", "pycountry", "wbgapi"]
+
+
+def page_imports(path):
+    """Returns the top-level import statements of a page as source code."""
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    nodes = [n for n in tree.body if isinstance(n, (ast.Import, ast.ImportFrom))]
+    return "\n".join(ast.unparse(n) for n in nodes)
+
+
+def cold_import(code, importtime=False):
+    """
+    Runs code in a fresh interpreter. Returns its wall time in seconds, the
+    loaded modules and the -X importtime lines (if importtime is True).
+    """
+    script = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"{code}\n"
+        "print(time.perf_counter() - start)\n"
+        "print(','.join(sys.modules))\n"
+    )
+    flags = ["-X", "importtime"] if importtime else []
+    result = subprocess.run(
+        [sys.executable, *flags, "-c", script],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        check=True,
+    )
+    seconds, modules = result.stdout.strip().splitlines()[-2:]
+    return float(seconds), modules.split(","), result.stderr.splitlines()
+
+
+def package_times(importtime_lines, baseline=()):
+    """
+    Import time (seconds) per top-level package from -X importtime output:
+    the self times of all its modules, without the modules in baseline
+    (loaded by the interpreter before the page's imports).
+    """
+    times = {}
+    for line in importtime_lines:
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        name = name.strip()
+        if name in baseline:
+            continue
+        package = name.split(".")[0]
+        times[package] = times.get(package, 0) + int(self_us) / 1e6
+    return sorted(times.items(), key=lambda item: -item[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--budget", type=float, default=BUDGET_S)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="packages shown per page")
+    args = parser.parse_args()
+
+    # Modules of the interpreter start-up, not counted for the pages
+    baseline = set(cold_import("pass")[1])
+
+    failed = False
+    for page in PAGES:
+        code = page_imports(page)
+        times = [cold_import(code)[0] for _ in range(args.repeat)]
+        _, modules, lines = cold_import(code, importtime=True)
+        median = statistics.median(times)
+        deferred = [m for m in DEFERRED if m in modules]
+        over = median > args.budget
+
+        status = "OVER BUDGET" if over else "ok"
+        print(f"{page.name}: {median:.3f} s (budget {args.budget:.3f} s) {status}")
+        for package, seconds in package_times(lines, baseline)[: args.top]:
+            print(f"    {package:28} {seconds:.3f} s")
+        if deferred:
+            print(f"    loads deferred dependencies: {', '.join(deferred)}")
+        failed |= over or bool(deferred)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
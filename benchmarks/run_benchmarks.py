@@ -0,0 +1,318 @@
+"""
+Benchmarks of the data pipeline, analysis functions and figure builders on
+synthetic panels scaled to multiples of the real panel size
+(123 countries x 24 years x 15 indicators).
+
+Run from the project root:
+    python -m benchmarks.run_benchmarks --scales 10 100 1000
+Compare two result files (e.g. from two commits):
+    python -m benchmarks.run_benchmarks --compare old.json new.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import warnings
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from project_code import cache
+from project_code.analysis import (
+    calculate_correlations,
+    correlation_over_time,
+    partial_corr,
+    regression,
+    regression_batch,
+    rolling_correlation,
+)
+from project_code.coverage import Coverage, coverage_policy
+from project_code.data_cleaning import (
+    INDICATOR_NAMES,
+    build_panel,
+    load_indicator_data,
+    load_snapshot,
+    open_coverage,
+    open_panel_store,
+    threshold_panel,
+)
+from project_code.inference import correlation_inference, regression_inference
+from project_code.panel import Panel
+from project_code.utils import merge_indicators
+from project_code.visualization import animated_scatter, plot_map
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+# Size of the real panel
+ECONOMIES = 123
+YEARS = 24
+INDICATORS = 15
+
+
+def panel_size(scale):
+    """Grows every dimension by the cube root of scale so cells grow by scale."""
+    factor = scale ** (1 / 3)
+    return (
+        round(ECONOMIES * factor),
+        round(YEARS * factor),
+        round(INDICATORS * factor),
+    )
+
+
+def synthetic_raw_data(n_economies, n_years, n_indicators, seed=0):
+    """
+    Creates raw data in the World Bank format (economy, series, YR2000...)
+    with country effects, a trend, noise and about 10% missing values. Like
+    the real data, the last indicator and about 3% of the economies miss half
+    of the values, so the default thresholds drop them.
+    """
+    rng = np.random.default_rng(seed)
+    codes = list(INDICATOR_NAMES)[:n_indicators]
+    codes += [f"SYN.{i:04d}" for i in range(n_indicators - len(codes))]
+    economies = [f"E{i:06d}" for i in range(n_economies)]
+    years = [f"YR{2000 + i}" for i in range(n_years)]
+
+    shape = (n_economies, n_indicators, n_years)
+    values = (
+        rng.normal(50, 10, shape[:2])[:, :, None]
+        + np.linspace(0, 5, n_years)
+        + rng.normal(0, 2, shape)
+    )
+    missing = np.full(shape, 0.1)
+    missing[:, -1] = 0.5
+    missing[rng.random(n_economies) < 0.03] = 0.5
+    values[rng.random(shape) < missing] = np.nan
+
+    index = pd.MultiIndex.from_product([economies, codes], names=["economy", "series"])
+    raw = pd.DataFrame(values.reshape(-1, n_years), index=index, columns=years)
+    return raw.reset_index()
+
+
+def measure(func, setup=None, repeat=5):
+    """Runs func repeat times (after setup, which is not timed) and returns the times."""
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_scale(scale, repeat, only=None):
+    """
+    Runs all benchmarks on a synthetic panel of the given scale, its files are
+    written to a temporary folder removed afterwards.
+    """
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:
+        try:
+            return _run_scale(scale, repeat, only, Path(tmp))
+        finally:
+            # Unmap the stores in the folder before it is removed
+            for loader in (
+                open_panel_store,
+                open_coverage,
+                threshold_panel,
+                load_snapshot,
+            ):
+                loader.clear()
+
+
+def _run_scale(scale, repeat, only, tmp):
+    """Runs the benchmarks of run_scale with the files in the tmp folder."""
+    n_economies, n_years, n_indicators = panel_size(scale)
+    raw = synthetic_raw_data(n_economies, n_years, n_indicators)
+    raw_path = tmp / "raw.csv"
+    raw.to_csv(raw_path, index=False)
+    panel_dir = tmp / "panel"
+
+    # The full store with its coverage cube, loading applies the default
+    # thresholds on it
+    coverage = Coverage.from_raw([raw])
+    with contextlib.redirect_stdout(io.StringIO()):
+        build_panel(path=panel_dir, raw_path=raw_path)
+
+    def open_panel(rename=False):
+        open_panel_store.clear()
+        open_coverage.clear()
+        threshold_panel.clear()
+        load_snapshot.clear()
+        return load_indicator_data(rename_countries=rename, path=panel_dir)
+
+    def load_all(rename):
+        panel = open_panel(rename)
+        for ind in panel:
+            panel[ind]
+
+    panel = open_panel()
+    x, y, z = panel.indicators[:3]
+    year = int(np.max(panel.year))
+
+    # Fill the panel's in-memory caches for the warm benchmarks
+    calculate_correlations(panel, x, y, year)
+    partial_corr(panel, x, y, z, year)
+
+    # Every one of 3 indicators against every one of 3 others
+    sweep = [
+        (dep, ind) for dep in panel.indicators[:3] for ind in panel.indicators[3:6]
+    ]
+
+    def fresh():
+        return (open_panel(),)
+
+    benchmarks = {
+        "etl.read_raw": (lambda: pd.read_csv(raw_path), None),
+        "etl.build_panel": (
+            lambda: build_panel(path=tmp / "build", raw_path=raw_path),
+            None,
+        ),
+        "coverage.from_raw": (lambda: Coverage.from_raw([raw]), None),
+        "coverage.apply": (lambda: coverage.apply(coverage_policy(0.2)), None),
+        "load_indicator_data": (lambda: load_all(False), None),
+        "load_indicator_data.renamed": (lambda: load_all(True), None),
+        "panel.metadata": (lambda p: p.metadata, lambda: (Panel.open(panel_dir),)),
+        "merge_indicators.2": (lambda: merge_indicators(panel, [x, y]), None),
+        "merge_indicators.3": (lambda: merge_indicators(panel, [x, y, z]), None),
+        "merge_indicators.year": (
+            lambda: merge_indicators(panel, [x, y, z], year=year),
+            None,
+        ),
+        "calculate_correlations.cold": (
+            lambda p: calculate_correlations(p, x, y, year),
+            fresh,
+        ),
+        "calculate_correlations.warm": (
+            lambda: calculate_correlations(panel, x, y, year),
+            None,
+        ),
+        "partial_corr.cold": (lambda p: partial_corr(p, x, y, z, year), fresh),
+        "partial_corr.warm": (lambda: partial_corr(panel, x, y, z, year), None),
+        "correlation_over_time": (
+            lambda p: correlation_over_time(p, x, y, window=3),
+            fresh,
+        ),
+        "rolling_correlation": (lambda p: rolling_correlation(p, x, y), fresh),
+        "regression": (lambda: regression(panel, x, [y, z]), None),
+        "regression.clustered": (
+            lambda: regression(panel, x, [y, z], clustered=True),
+            None,
+        ),
+        "correlation_inference": (
+            lambda: correlation_inference(panel, x, y, year, control=z),
+            None,
+        ),
+        "regression_inference": (
+            lambda: regression_inference(panel, x, [y, z]),
+            None,
+        ),
+        "regression_batch": (
+            lambda: regression_batch(
+                panel,
+                [(dep, [ind], cl) for dep, ind in sweep for cl in (False, True)],
+            ),
+            None,
+        ),
+        "plot_map": (lambda p: plot_map(p, x, year), fresh),
+        "animated_scatter": (lambda: animated_scatter(panel, x, y), None),
+    }
+
+    results = []
+    for name, (func, setup) in benchmarks.items():
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        with contextlib.redirect_stdout(io.StringIO()):
+            times = measure(func, setup, repeat)
+        results.append(
+            {
+                "benchmark": name,
+                "scale": scale,
+                "economies": n_economies,
+                "years": n_years,
+                "indicators": n_indicators,
+                "repeat": repeat,
+                "min_s": min(times),
+                "median_s": statistics.median(times),
+            }
+        )
+        print(f"{name:32} x{scale:<5} median {statistics.median(times):.4f} s")
+
+    return results
+
+
+def git_commit():
+    """Returns the current git commit hash (or 'unknown' outside a repository)."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old_path, new_path):
+    """Prints the median time ratio new/old of every benchmark in both files."""
+    with open(old_path) as f:
+        old = {(r["benchmark"], r["scale"]): r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = {(r["benchmark"], r["scale"]): r for r in json.load(f)["results"]}
+
+    for key in sorted(old.keys() & new.keys(), key=lambda k: (k[1], k[0])):
+        ratio = new[key]["median_s"] / old[key]["median_s"]
+        flag = "  <-- slower" if ratio > 1.2 else ""
+        print(
+            f"{key[0]:32} x{key[1]:<5} {old[key]['median_s']:.4f} s -> "
+            f"{new[key]['median_s']:.4f} s ({ratio:.2f}x){flag}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="+", help="run benchmarks with these prefixes")
+    parser.add_argument("--output", help="result file (default results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # Measure the computations, not the on-disk result cache
+    cache.ENABLED = False
+    warnings.simplefilter("ignore")
+
+    results = []
+    for scale in args.scales:
+        results += run_scale(scale, args.repeat, args.only)
+
+    commit = git_commit()
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "commit": commit,
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "pandas": pd.__version__,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,30 +3,45 @@ Page for dasboard displaying the scatterplots and correlations.
 """
 
 import streamlit as st
-from project_code.data_cleaning import load_indicator_data
+from project_code.data_cleaning import MAX_MISSING, load_indicator_data
 from project_code.visualization import (
     correlation_scatterplot,
     animated_scatter,
     scatterplot_3d,
+    correlation_over_time_chart,
 )
 from project_code.analysis import calculate_correlations, partial_corr
+from project_code.inference import N_REPLICATES, correlation_inference
+from project_code.instrumentation import start_rerun, timed, report_rerun
+from project_code.panel import snapshot_exists
+from project_code.catalog import indicator_label
 
 st.set_page_config(page_title="The Wealth of Nations", layout="wide", page_icon="🗺️")
+start_rerun()
 
 st.title("📈 Scatterplots and Correlations")
-st.markdown(
-    """
+st.markdown("""
 ## Explore correlation between two indicators per chosen year or see the animated version over the years.
-"""
-)
+""")
+
+# The data is set up from the Global overview page
+if not snapshot_exists():
+    st.info("The data is being set up, please start from the Global overview page.")
+    st.stop()
 
 # Load data
-data = load_indicator_data(rename_countries=True)
+with timed("data.load"):
+    data = load_indicator_data(
+        rename_countries=True,
+        max_missing=st.session_state.get("max_missing", MAX_MISSING),
+    )
 
 # Let user select indicators
 indicators = list(data.keys())
-indicator_display_names = {name: name.replace("_", " ").title() for name in indicators}
-default_indicator_x = indicators.index("life_expectancy")
+indicator_display_names = {name: indicator_label(name) for name in indicators}
+default_indicator_x = (
+    indicators.index("life_expectancy") if "life_expectancy" in indicators else 0
+)
 
 indicator_x = st.selectbox(
     "Select X indicator",
@@ -38,7 +53,9 @@ indicator_x = st.selectbox(
 
 # Remove the selected X indicator from Y options
 available_for_y = [ind for ind in indicators if ind != indicator_x]
-default_indicator_y = indicators.index("co2_per_capita")
+default_indicator_y = (
+    indicators.index("co2_per_capita") if "co2_per_capita" in indicators else 0
+)
 
 indicator_y = st.selectbox(
     "Select Y indicator",
@@ -48,13 +65,18 @@ indicator_y = st.selectbox(
     index=default_indicator_y,
 )
 
-# Let user choose a year
-year = st.slider(
-    "Select year",
-    min_value=min(data[indicator_x]["year"]),
-    max_value=max(data[indicator_x]["year"]),
-    value=max(data[indicator_x]["year"]),  # default latest year
-)
+# Let user choose a year (bounds from the metadata index of the panel)
+metadata = data.metadata.loc[indicator_x]
+year = int(metadata["last_year"])  # default latest year
+if metadata["first_year"] < metadata["last_year"]:
+    year = st.slider(
+        "Select year",
+        min_value=int(metadata["first_year"]),
+        max_value=year,
+        value=year,
+    )
+else:
+    st.markdown(f"Data available for {year} only.")
 
 st.markdown(" Click on the button below to view the animated version.")
 if st.button(" ▶  Animate over years", key="animate_button"):
@@ -71,26 +93,71 @@ st.markdown(
     f"> Correlation coefficient: {correlation:.2f}"
 )  # rounded to 2 decimal places
 
-st.markdown(
-    """
+# Resampling inference (country bootstrap and permutations)
+show_inference = st.checkbox(
+    "Show bootstrap confidence intervals and permutation p-values",
+    value=False,
+    help=f"Computed from {N_REPLICATES} resamples of the countries.",
+)
+if show_inference:
+    inference = correlation_inference(data, indicator_x, indicator_y, year)
+    st.markdown(
+        f"> 95% bootstrap CI: [{inference['CI 2.5%']:.2f}, {inference['CI 97.5%']:.2f}], "
+        f"permutation p-value: {inference['p-value']:.4f} ({inference['n']:.0f} countries)"
+    )
+
+# Correlation of the selected indicators over all years
+st.markdown("### Correlation over time")
+col_window, col_countries = st.columns([1, 2])
+with col_window:
+    window = st.slider(
+        "Years per window",
+        min_value=1,
+        max_value=10,
+        value=1,
+        help="With more than one year, the countries of all years in the window are pooled.",
+    )
+with col_countries:
+    countries = st.multiselect(
+        "Compare with the correlation over time within countries",
+        options=list(data.economy_table["name"]),
+        help="Rolling correlation over 5-year windows within each selected country.",
+    )
+fig_over_time = correlation_over_time_chart(
+    data, indicator_x, indicator_y, window=window, countries=countries
+)
+st.plotly_chart(fig_over_time)
+
+st.markdown("""
 Did you find any shocking correlations? I know, seeing that there is negative correlation 
 between pollution and mortality might seem counter-intuitive at first. But remember, correlation 
 does not imply causation! This is why we cannot relay on only correlation bewteen two variables 
 to draw conclusions about their relationship. Let's look at a 3D scatterplot including GDP per 
 capita as a third variable to see if that helps explain the relationship better. GDP per capita 
 helps to account for differences in wealth between countries, which can impactall of the indicators.
-"""
-)
+""")
 
 # Scatterplot 3D with GDP per capita as third variable
+# (left out if the missing data threshold drops GDP per capita)
 indicator_z = "gdp_per_capita"
 
-fig2 = scatterplot_3d(data, indicator_x, indicator_y, indicator_z, year)
-st.plotly_chart(fig2)
-
-partial_correlation = partial_corr(data, indicator_x, indicator_y, indicator_z, year)
-# Show partial correlation for selected year
-st.markdown(
-    f"> Partial correlation coefficient for the selected indicators controlling for GDP: "
-    f"{partial_correlation:.2f}"
-)
+if indicator_z in indicators:
+    fig2 = scatterplot_3d(data, indicator_x, indicator_y, indicator_z, year)
+    st.plotly_chart(fig2)
+
+    partial_correlation = partial_corr(data, indicator_x, indicator_y, indicator_z, year)
+    # Show partial correlation for selected year
+    st.markdown(
+        f"> Partial correlation coefficient for the selected indicators controlling for GDP: "
+        f"{partial_correlation:.2f}"
+    )
+    if show_inference:
+        inference = correlation_inference(
+            data, indicator_x, indicator_y, year, control=indicator_z
+        )
+        st.markdown(
+            f"> 95% bootstrap CI: [{inference['CI 2.5%']:.2f}, {inference['CI 97.5%']:.2f}], "
+            f"permutation p-value: {inference['p-value']:.4f} ({inference['n']:.0f} countries)"
+        )
+
+report_rerun("scatterplots")
@@ -3,22 +3,35 @@ Dashboard page showing the regression.
 """
 
 import streamlit as st
-from project_code.data_cleaning import load_indicator_data
+from project_code.data_cleaning import MAX_MISSING, load_indicator_data
 from project_code.analysis import regression
+from project_code.inference import N_REPLICATES, regression_inference
 from project_code.visualization import regression_summary_table, highlight_significant
+from project_code.instrumentation import start_rerun, timed, report_rerun
+from project_code.panel import snapshot_exists
+from project_code.catalog import indicator_label
 
 st.set_page_config(page_title="The Wealth of Nations", layout="wide", page_icon="🗺️")
+start_rerun()
 
 st.title("📐 Regression analysis")
 
+# The data is set up from the Global overview page
+if not snapshot_exists():
+    st.info("The data is being set up, please start from the Global overview page.")
+    st.stop()
+
 # Load data
-data = load_indicator_data(rename_countries=False)
+with timed("data.load"):
+    data = load_indicator_data(
+        rename_countries=False,
+        max_missing=st.session_state.get("max_missing", MAX_MISSING),
+    )
 indicators = list(data.keys())
-indicator_display_names = {name: name.replace("_", " ").title() for name in indicators}
+indicator_display_names = {name: indicator_label(name) for name in indicators}
 
 with st.expander("What is Regression Analysis?", expanded=False):
-    st.markdown(
-        """
+    st.markdown("""
     **Regression analysis** helps us understand the relationship between variables.
     - Does higher GDP lead to better health outcomes?
     - How does health expenditure relate to life expectancy?
@@ -26,12 +39,11 @@ with st.expander("What is Regression Analysis?", expanded=False):
     This specific regression model runs a **panel regression with country fixed effects**.
     - Controls for unchanging country characteristics (culture, geography, etc.)
     - Analyzes how changes in one variable relate to changes in another over time
-    """
-    )
+    - Optionally adds **year fixed effects** to control for shocks shared by all countries in a year
+    """)
 
 with st.expander(" How to Read the Results Table", expanded=False):
-    st.markdown(
-        """
+    st.markdown("""
     **Variables**: The factors you selected to analyze
     - Y is the **dependent** variable, the one you want to analyse and see how other factors 
     influence it.
@@ -67,8 +79,8 @@ with st.expander(" How to Read the Results Table", expanded=False):
     - We're 95% confident the true effect falls within this range
     - If the interval includes 0, the effect might not be real
     
-    **Intercept**: The baseline value when all predictors are zero (often not meaningful to 
-    interpret)
+    **Intercept**: Not shown, the country fixed effects replace it with a separate baseline 
+    value for every country (these are not meaningful to interpret)
     
     **R² (R-squared)**: Measures how well your model explains the variation in the dependent 
     variable
@@ -84,11 +96,12 @@ with st.expander(" How to Read the Results Table", expanded=False):
     **Note**: In panel regressions with country fixed effects, R² can be very high (0.8-0.9+) 
     because fixed effects explain a lot of variation. Focus more on coefficient significance 
     and adjusted R² in this case.
-    """
-    )
+    """)
 
 # Let user select dependent variable
-default_indicator = indicators.index("life_expectancy")
+default_indicator = (
+    indicators.index("life_expectancy") if "life_expectancy" in indicators else 0
+)
 var_y = st.selectbox(
     "Select dependent variable:",
     options=indicators,
@@ -107,23 +120,47 @@ vars_x = st.multiselect(
 # Cluster option
 clustered = st.checkbox("Use clustered standard errors by country", value=False)
 
+# Year fixed effects option
+time_effects = st.checkbox("Include year fixed effects", value=False)
+
+# Resampling inference option
+show_inference = st.checkbox(
+    "Add bootstrap confidence intervals and permutation p-values",
+    value=False,
+    help=f"Computed from {N_REPLICATES} country-block resamples.",
+)
+
 # Print the regression summary table
 if vars_x and st.button("Run regression"):
-    result = regression(data, var_y, vars_x, clustered=clustered)
+    result = regression(
+        data, var_y, vars_x, clustered=clustered, time_effects=time_effects
+    )
     summary_df = regression_summary_table(result)
 
     st.subheader("Regression Results")
 
     # Show R2 and Adjusted R2
-    st.markdown(
-        f"""
+    st.markdown(f"""
     R² = {result.rsquared:.3f}
     \nAdjusted R² = {result.rsquared_adj:.3f}  
-    """
-    )
+    """)
 
     st.dataframe(summary_df.style.apply(highlight_significant, axis=1))
 
     st.text(
         "The highlighted rows demonstate the variables with P-value < 0.05 which shows significance."
     )
+
+    if show_inference:
+        st.subheader("Resampling inference")
+        inference_df = regression_inference(
+            data, var_y, vars_x, time_effects=time_effects
+        )
+        st.dataframe(inference_df.round(5), hide_index=True)
+        st.caption(
+            "Confidence intervals from resampling whole countries with replacement, "
+            "p-values from randomly flipping the sign of each country's residuals "
+            "of the model without the variable."
+        )
+
+report_rerun("regression")
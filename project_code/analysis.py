@@ -1,75 +1,517 @@
 """
 This module contains functions for the empirical analysis such as for
-calculation of correlation, partial correlation and regression.
+calculation of correlation, partial correlation and fixed effects regression.
+Correlations are computed for all indicator pairs and years at once and cached
+on the panel, correlation tensors and regressions are also cached on disk.
 """
 
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import statsmodels.formula.api as smf
+import pandas as pd
+from project_code.cache import disk_cache
+from project_code.instrumentation import timed
+from project_code.panel import as_panel
 from project_code.utils import merge_indicators
 
 
-def calculate_correlations(data, indicator_x, indicator_y, year):
+def _standardize(cube):
+    """Centers and scales every (year, indicator) column to keep the sums well conditioned."""
+    # Years without any data for an indicator stay NaN
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(cube, axis=1, keepdims=True)
+        std = np.nanstd(cube, axis=1, keepdims=True)
+        std[std == 0] = 1
+        return (cube - mean) / std
+
+
+# Variances below this fraction of the sum of squares they are computed from
+# are rounding noise (a constant indicator), their correlation is NaN
+VARIANCE_TOL = 1e-10
+
+
+def _masked_corr(n, s_x, s_y, s_xx, s_yy, s_xy, scale=None):
+    """
+    Pearson correlation from sums taken over the pairwise-complete rows.
+    scale: the sums were differences of these (moments on the last axis), the
+    variance guard is then relative to their sums of squares.
     """
-    Calculates correlation coefficients for two indicators across all years.
+    if scale is None:
+        s_xx_scale, s_yy_scale = s_xx, s_yy
+    else:
+        s_xx_scale, s_yy_scale = np.moveaxis(scale, -1, 0)[3:5]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = s_xy - s_x * s_y / n
+        var_x = s_xx - s_x**2 / n
+        var_y = s_yy - s_y**2 / n
+        corr = cov / np.sqrt(var_x * var_y)
+    constant = (var_x <= VARIANCE_TOL * s_xx_scale) | (
+        var_y <= VARIANCE_TOL * s_yy_scale
+    )
+    corr[(n < 2) | constant] = np.nan
+    return np.clip(corr, -1, 1)
+
+
+@timed("analysis.correlation_tensor")
+def correlation_tensor(data):
     """
-    # Merge the two indicators
-    df, val_cols = merge_indicators(data, [indicator_x, indicator_y])
+    Computes the correlation of every pair of indicators in every year in one
+    vectorized pass, using the rows where both indicators are present.
+    Returns a (year, indicator, indicator) array and the years of its first axis.
+    The result is cached on the panel and on disk.
+    """
+    panel = as_panel(data)
+    if "correlation_tensor" not in panel.cache:
+        panel.cache["correlation_tensor"] = _correlation_tensor(panel)
+    return panel.cache["correlation_tensor"]
+
+
+@disk_cache
+def _correlation_tensor(panel):
+    """Computes the correlation tensor of the panel (see correlation_tensor)."""
+    cube, years = panel.cube()
+    mask = (~np.isnan(cube)).astype(float)
+    x = np.nan_to_num(_standardize(cube))
+
+    # Sums over rows where indicator i and indicator j are both present
+    n = np.einsum("yni,ynj->yij", mask, mask)
+    s_x = np.einsum("yni,ynj->yij", x, mask)
+    s_xx = np.einsum("yni,ynj->yij", x**2, mask)
+    s_xy = np.einsum("yni,ynj->yij", x, x)
+    corr = _masked_corr(
+        n, s_x, s_x.transpose(0, 2, 1), s_xx, s_xx.transpose(0, 2, 1), s_xy
+    )
+    return corr, years
+
+
+@timed("analysis.partial_correlation_tensor")
+def partial_correlation_tensor(data, control):
+    """
+    Computes the partial correlation of every pair of indicators in every year
+    controlling for the `control` indicator, using the rows where the pair and
+    the control are all present. The 3x3 correlation matrix of each triple is
+    inverted in one batch and the partial correlation read from the precision
+    matrix. Returns a (year, indicator, indicator) array and the years of its
+    first axis. The result is cached on the panel (per control) and on disk.
+    """
+    panel = as_panel(data)
+    key = ("partial_correlation_tensor", control)
+    if key not in panel.cache:
+        panel.cache[key] = _partial_correlation_tensor(panel, control)
+    return panel.cache[key]
+
+
+@disk_cache
+def _partial_correlation_tensor(panel, control):
+    """Computes the partial correlation tensor (see partial_correlation_tensor)."""
+    cube, years = panel.cube()
+    k = panel.indicators.index(control)
+    mask = (~np.isnan(cube)).astype(float)
+    x = np.nan_to_num(_standardize(cube))
+
+    # Weight every row by the presence of the control indicator
+    z_mask = mask[:, :, [k]]
+    z = x[:, :, [k]]
+    mask_z = mask * z_mask
+    x_z = x * z_mask
+
+    # Sums over rows where indicators i, j and the control are all present
+    n = np.einsum("yni,ynj->yij", mask_z, mask)
+    s_i = np.einsum("yni,ynj->yij", x_z, mask)
+    s_ii = np.einsum("yni,ynj->yij", x_z * x, mask)
+    s_ij = np.einsum("yni,ynj->yij", x_z, x)
+    s_z = np.einsum("yni,ynj->yij", mask_z * z, mask)
+    s_zz = np.einsum("yni,ynj->yij", mask_z * z**2, mask)
+    s_iz = np.einsum("yni,ynj->yij", x_z * z, mask)
+
+    def t(a):
+        return a.transpose(0, 2, 1)
+
+    r_ij = _masked_corr(n, s_i, t(s_i), s_ii, t(s_ii), s_ij)
+    r_iz = _masked_corr(n, s_i, s_z, s_ii, s_zz, s_iz)
+    r_jz = t(r_iz)
 
-    # Detect value columns
-    val_x = val_cols[indicator_x]
-    val_y = val_cols[indicator_y]
+    # Batch of 3x3 correlation matrices of (i, j, control)
+    corr = np.empty(r_ij.shape + (3, 3))
+    corr[..., [0, 1, 2], [0, 1, 2]] = 1
+    corr[..., 0, 1] = corr[..., 1, 0] = r_ij
+    corr[..., 0, 2] = corr[..., 2, 0] = r_iz
+    corr[..., 1, 2] = corr[..., 2, 1] = r_jz
 
-    # Calculate correlations for each year
-    df = df[df["year"] == year]
-    corr = np.corrcoef(df[val_x], df[val_y])[0, 1]  # correlation of x and y
+    # Singular matrices (e.g. i or j is the control) have no partial correlation
+    finite = np.isfinite(corr).all(axis=(-2, -1))
+    det = np.linalg.det(np.where(finite[..., None, None], corr, 0))
+    valid = finite & (np.abs(det) > 1e-12)
+    corr[~valid] = np.eye(3)
+    precision = np.linalg.inv(corr)
 
-    return corr
+    partial = -precision[..., 0, 1] / np.sqrt(
+        precision[..., 0, 0] * precision[..., 1, 1]
+    )
+    partial[~valid] = np.nan
+    return partial, years
+
+
+def _lookup(tensor, years, panel, indicator_x, indicator_y, year):
+    """Reads one (year, x, y) entry of a correlation tensor."""
+    t = np.searchsorted(years, year)
+    if t == len(years) or years[t] != year:
+        return np.nan
+    i = panel.indicators.index(indicator_x)
+    j = panel.indicators.index(indicator_y)
+    return tensor[t, i, j]
+
+
+def calculate_correlations(data, indicator_x, indicator_y, year):
+    """
+    Calculates correlation coefficient for two indicators in the given year
+    (a lookup in the cached correlation tensor).
+    """
+    panel = as_panel(data)
+    corr, years = correlation_tensor(panel)
+    return _lookup(corr, years, panel, indicator_x, indicator_y, year)
 
 
 def partial_corr(data, indicator_x, indicator_y, indicator_z, year):
     """
-    Computes partial correlation between x and y controlling for z.
+    Computes partial correlation between x and y controlling for z
+    (a lookup in the cached partial correlation tensor).
+    """
+    panel = as_panel(data)
+    partial, years = partial_correlation_tensor(panel, indicator_z)
+    return _lookup(partial, years, panel, indicator_x, indicator_y, year)
+
+
+def _pair_moments(panel, indicator_x, indicator_y, per_economy=False):
+    """
+    Returns the (year, economy, 6) moments n, x, y, x², y², xy of the cells
+    where both indicators are present (zero elsewhere) and the years of the
+    first axis. x and y are centered (per economy if per_economy) to keep the
+    sums well conditioned, correlations within the centered groups are unchanged.
+    """
+    cube, years = panel.cube([indicator_x, indicator_y])
+    x, y = cube[..., 0], cube[..., 1]
+    mask = ~np.isnan(x) & ~np.isnan(y)
+    axis = 0 if per_economy else None
+    with np.errstate(invalid="ignore", divide="ignore"):
+        n = mask.sum(axis=axis)
+        x = np.where(mask, x - np.where(mask, x, 0).sum(axis=axis) / n, 0)
+        y = np.where(mask, y - np.where(mask, y, 0).sum(axis=axis) / n, 0)
+    moments = np.stack([mask.astype(float), x, y, x**2, y**2, x * y], axis=-1)
+    return moments, years
+
+
+def _window_sums(moments, window):
+    """
+    Sums over the windows of `window` years ending at each year (axis 0), and
+    the cumulative sums they are differences of (their rounding error scales
+    with these).
+    """
+    # Differences of cumulative sums, one pass for all windows
+    cumulative = np.cumsum(moments, axis=0)
+    sums = cumulative.copy()
+    sums[window:] -= cumulative[:-window]
+    return sums, cumulative
+
+
+@timed("analysis.correlation_over_time")
+def correlation_over_time(data, indicator_x, indicator_y, window=1):
+    """
+    Computes the cross-country correlation of two indicators in every year,
+    or over windows of `window` years (the country-years of the window pooled).
+    Returns a DataFrame with the last year of each window, the correlation and
+    the number of observations (years before the first full window are NaN).
+    The result is cached on the panel.
+    """
+    panel = as_panel(data)
+    key = ("correlation_over_time", indicator_x, indicator_y, window)
+    if key not in panel.cache:
+        moments, years = _pair_moments(panel, indicator_x, indicator_y)
+        sums, cumulative = _window_sums(moments.sum(axis=1), window)
+        corr = _masked_corr(*np.moveaxis(sums, -1, 0), scale=cumulative)
+        corr[: window - 1] = np.nan
+        panel.cache[key] = pd.DataFrame(
+            {
+                "year": years,
+                "correlation": corr,
+                "observations": sums[:, 0].astype(int),
+            }
+        )
+    return panel.cache[key]
+
+
+@timed("analysis.rolling_correlation")
+def rolling_correlation(data, indicator_x, indicator_y, window=5, min_periods=3):
+    """
+    Computes the correlation of two indicators over time within every country,
+    over rolling windows of `window` years (at least min_periods years with
+    both indicators present, NaN otherwise).
+    Returns a DataFrame indexed by the last year of the window with one
+    column per economy. The result is cached on the panel.
+    """
+    panel = as_panel(data)
+    key = ("rolling_correlation", indicator_x, indicator_y, window, min_periods)
+    if key not in panel.cache:
+        moments, years = _pair_moments(
+            panel, indicator_x, indicator_y, per_economy=True
+        )
+        sums, cumulative = _window_sums(moments, window)
+        corr = _masked_corr(*np.moveaxis(sums, -1, 0), scale=cumulative)
+        corr[sums[..., 0] < min_periods] = np.nan
+        panel.cache[key] = pd.DataFrame(
+            corr,
+            index=pd.Index(years, name="year"),
+            columns=panel.economy.categories,
+        )
+    return panel.cache[key]
+
+
+class FixedEffectsResults:
+    """
+    Results of the fixed effects (within) estimator. Exposes the same
+    attributes as the statsmodels results used by the dashboard: params, bse,
+    tvalues, pvalues, conf_int(), rsquared and rsquared_adj.
+    """
+
+    def __init__(self, params, cov, nobs, df_resid, rsquared, use_t=True):
+        self.params = params
+        self.cov_params = pd.DataFrame(cov, index=params.index, columns=params.index)
+        self.bse = pd.Series(np.sqrt(np.diag(cov)), index=params.index)
+        self.tvalues = self.params / self.bse
+        self.nobs = nobs
+        self.df_resid = df_resid
+        # Like statsmodels: t distribution, normal for cluster-robust errors
+        self.use_t = use_t
+        self.pvalues = pd.Series(2 * self._sf(np.abs(self.tvalues)), index=params.index)
+        # R-squared of the equivalent dummy variable regression
+        self.rsquared = rsquared
+        self.rsquared_adj = 1 - (nobs - 1) / df_resid * (1 - rsquared)
+
+    def _sf(self, x):
+        """Survival function of the distribution of the t-values."""
+        # Deferred, scipy is only loaded once a model is fitted (special is
+        # the small part of scipy with the distribution functions)
+        from scipy import special
+
+        return special.stdtr(self.df_resid, -x) if self.use_t else special.ndtr(-x)
+
+    def _ppf(self, q):
+        """Quantile function of the distribution of the t-values."""
+        from scipy import special
+
+        return special.stdtrit(self.df_resid, q) if self.use_t else special.ndtri(q)
+
+    def conf_int(self, alpha=0.05):
+        """Confidence intervals of the coefficients (columns 0 and 1)."""
+        q = self._ppf(1 - alpha / 2)
+        return pd.DataFrame(
+            {0: self.params - q * self.bse, 1: self.params + q * self.bse}
+        )
+
+
+def _demean(values, groups, tol=1e-10, max_iter=1000):
+    """
+    Subtracts group means from each column of values (within transformation).
+    With several grouping variables (e.g. country and year) the means are
+    removed by alternating projections until no column changes by more than
+    tol relative to its norm.
+    """
+    values = values.copy()
+    # Convergence is relative to each column's scale (shares, dollars, ...)
+    scale = np.linalg.norm(values, axis=0)
+    for _ in range(max_iter):
+        before = values.copy()
+        for codes, counts in groups:
+            for col in range(values.shape[1]):
+                means = np.bincount(codes, weights=values[:, col]) / counts
+                values[:, col] -= means[codes]
+        if len(groups) == 1:
+            break
+        change = np.max(np.abs(values - before), axis=0, initial=0.0)
+        if np.all(change <= tol * scale):
+            break
+    else:
+        warnings.warn(
+            f"Fixed effects demeaning did not converge after {max_iter} iterations",
+            RuntimeWarning,
+            stacklevel=2,
+        )
+    return values
+
+
+def _fe_groups(economy, year=None):
+    """Integer codes and sizes of the fixed effect groups (country and optionally year)."""
+    # Integer group codes (for a categorical economy column its codes are reused)
+    economy_codes = pd.factorize(economy)[0]
+    groups = [(economy_codes, np.bincount(economy_codes))]
+    if year is not None:
+        year_codes = pd.factorize(year)[0]
+        groups.append((year_codes, np.bincount(year_codes)))
+    return groups
+
+
+def _fit_within(y_values, y_w, X_w, groups, names, clustered=False):
+    """
+    Fits the slopes on demeaned data y_w, X_w (see fixed_effects_ols),
+    y_values: the dependent variable before demeaning (for the R-squared).
     """
-    # Merge the three indicators
-    df, val_cols = merge_indicators(data, [indicator_x, indicator_y, indicator_z])
+    n, k = X_w.shape
+    # Parameters absorbed by the fixed effects (including the intercept)
+    absorbed = sum(len(counts) for _, counts in groups) - (len(groups) - 1)
+    n_params = k + absorbed
 
-    # Detect value columns
-    val_x = val_cols[indicator_x]
-    val_y = val_cols[indicator_y]
-    val_z = val_cols[indicator_z]
+    xtx_inv = np.linalg.inv(X_w.T @ X_w)
+    beta = xtx_inv @ X_w.T @ y_w
+    resid = y_w - X_w @ beta
+    ssr = resid @ resid
+    df_resid = n - n_params
+
+    if clustered:
+        # Sandwich with the score of each country summed over its rows
+        economy_codes, counts = groups[0]
+        n_groups = len(counts)
+        scores = np.zeros((n_groups, k))
+        np.add.at(scores, economy_codes, X_w * resid[:, None])
+        meat = scores.T @ scores
+        correction = n_groups / (n_groups - 1) * (n - 1) / (n - n_params)
+        cov = correction * xtx_inv @ meat @ xtx_inv
+    else:
+        cov = ssr / df_resid * xtx_inv
 
-    df = df[df["year"] == year]
+    rsquared = 1 - ssr / np.sum((y_values - y_values.mean()) ** 2)
 
-    # Regular correlations
-    corr_xy = np.corrcoef(df[val_x], df[val_y])[0, 1]
-    corr_xz = np.corrcoef(df[val_x], df[val_z])[0, 1]
-    corr_yz = np.corrcoef(df[val_y], df[val_z])[0, 1]
+    return FixedEffectsResults(
+        params=pd.Series(beta, index=names),
+        cov=cov,
+        nobs=n,
+        df_resid=df_resid,
+        rsquared=rsquared,
+        use_t=not clustered,
+    )
 
-    # Partial correlation formula
-    numerator = corr_xy - corr_xz * corr_yz
-    denominator = np.sqrt((1 - corr_xz**2) * (1 - corr_yz**2))
 
-    if denominator == 0:
-        return np.nan  # avoid division by zero
-    return numerator / denominator
+@timed("fit.fixed_effects_ols")
+def fixed_effects_ols(y, X, economy, year=None, clustered=False):
+    """
+    Estimates the slopes of y on X with country (and optionally year) fixed
+    effects by demeaning instead of adding a dummy column per country.
+    Gives the same slopes, standard errors (also clustered by country) and
+    R-squared as OLS with C(economy) dummies.
+    y: Series, X: DataFrame, economy/year: arrays with the group of each row
+    """
+    groups = _fe_groups(economy, year)
+    data = np.column_stack([y.to_numpy(dtype=float), X.to_numpy(dtype=float)])
+    within = _demean(data, groups)
+    return _fit_within(
+        data[:, 0], within[:, 0], within[:, 1:], groups, X.columns, clustered
+    )
 
 
-def regression(data, dep_var, indep_vars: list, clustered=False):
+@timed("fit.regression")
+@disk_cache
+def regression(data, dep_var, indep_vars: list, clustered=False, time_effects=False):
     """
-    Panel regression with country fixed effects (and optional clustered errors).
+    Panel regression with country fixed effects (and optional clustered errors
+    and year fixed effects), estimated with the within transformation.
     """
     df, val_cols = merge_indicators(data, [dep_var] + indep_vars)
 
     dep_col = val_cols[dep_var]
     ind_cols = [val_cols[ind] for ind in indep_vars]
 
-    formula = f"{dep_col} ~ {' + '.join(ind_cols)} + C(economy)"
+    model = fixed_effects_ols(
+        df[dep_col],
+        df[ind_cols],
+        economy=df["economy"],
+        year=df["year"] if time_effects else None,
+        clustered=clustered,
+    )
 
-    if clustered:
-        model = smf.ols(formula=formula, data=df).fit(
-            cov_type="cluster", cov_kwds={"groups": df["economy"]}
+    return model
+
+
+def _result_rows(result):
+    """Rows of the coefficients of a result, with the regression_summary_table columns."""
+    conf_int = result.conf_int()
+    return pd.DataFrame(
+        {
+            "Variables": [
+                name.replace("_", " ").title() for name in result.params.index
+            ],
+            "Coefficients": result.params.values,
+            "Std. Error": result.bse.values,
+            "t-value": result.tvalues.values,
+            "P-value": result.pvalues.values,
+            "CI 2.5%": conf_int[0].values,
+            "CI 97.5%": conf_int[1].values,
+        }
+    )
+
+
+@timed("fit.regression_batch")
+def regression_batch(data, specs, time_effects=False, max_workers=4):
+    """
+    Fits many fixed effects regressions (like regression) in one pass.
+    specs: list of (dep_var, indep_vars, clustered) tuples.
+    The indicators are read from the panel once, every demeaned column is
+    computed once per estimation sample and shared by all specs using it,
+    and the specs are fitted on a pool of max_workers threads.
+    Returns a tidy DataFrame with one row per spec and variable: the spec
+    number, dependent variable, the columns of regression_summary_table,
+    R-squared, adjusted R-squared and number of observations.
+    """
+    panel = as_panel(data)
+    variables = list(dict.fromkeys(v for dep, ind, _ in specs for v in [dep, *ind]))
+    cols, _ = panel.columns(variables)
+    cols = dict(zip(variables, cols))
+
+    samples = {}  # variables of a sample -> (rows, fixed effect groups)
+    within = {}  # (variables of a sample, variable) -> demeaned column
+
+    def sample(key):
+        if key not in samples:
+            rows = panel.kept()
+            for v in key:
+                rows &= ~np.isnan(cols[v])
+            year = panel.year[rows] if time_effects else None
+            samples[key] = (rows, _fe_groups(panel.economy[rows], year))
+        return samples[key]
+
+    def demeaned(key, v):
+        if (key, v) not in within:
+            rows, groups = sample(key)
+            within[(key, v)] = _demean(cols[v][rows][:, None], groups)[:, 0]
+        return within[(key, v)]
+
+    # Demean serially, so every shared column is computed only once
+    designs = []
+    for dep, ind, clustered in specs:
+        key = tuple(sorted({dep, *ind}))
+        rows, groups = sample(key)
+        designs.append(
+            (
+                cols[dep][rows],
+                demeaned(key, dep),
+                np.column_stack([demeaned(key, v) for v in ind]),
+                groups,
+                # Same coefficient names as regression
+                [f"{v}_{i}" for i, v in enumerate(ind, start=1)],
+                clustered,
+            )
         )
-    else:
-        model = smf.ols(formula=formula, data=df).fit()
 
-    return model
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(lambda design: _fit_within(*design), designs))
+
+    tables = []
+    for i, ((dep, _, clustered), result) in enumerate(zip(specs, results)):
+        table = _result_rows(result)
+        table.insert(0, "Dependent", dep)
+        table.insert(0, "Spec", i)
+        table["Clustered"] = clustered
+        table["R²"] = result.rsquared
+        table["Adjusted R²"] = result.rsquared_adj
+        table["Observations"] = result.nobs
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
@@ -0,0 +1,96 @@
+"""
+This module contains a persistent on-disk cache for the results of the
+analysis and figure functions. Results are keyed by the panel data version,
+the source code of the project and the function arguments, shared by all processes using the same data
+folder and evicted least recently used first when over the size limit.
+"""
+
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from project_code.panel import Panel
+
+CACHE_DIR = Path(__file__).parent.parent / "data" / "cache"
+MAX_CACHE_BYTES = 512 * 1024**2  # 512 MB
+ENABLED = True  # set to False to always recompute (e.g. for benchmarks)
+SOURCE_DIR = Path(__file__).parent  # the project_code package
+
+
+@functools.cache  # the sources are hashed once per process
+def source_version(path=SOURCE_DIR):
+    """
+    Hash of all Python sources of the package: any change of a cached
+    function, of a function it calls, of its literals or of the classes of
+    its results gives new keys, so a deploy never serves stale results.
+    """
+    h = hashlib.sha256()
+    for source in sorted(Path(path).rglob("*.py")):
+        h.update(source.relative_to(path).as_posix().encode())
+        h.update(source.read_bytes())
+    return h.hexdigest()
+
+
+def _cache_key(func, version, args, kwargs):
+    """Hash of the function name, the sources, the data version and the arguments."""
+    h = hashlib.sha256()
+    h.update(source_version().encode())
+    h.update(f"{func.__module__}.{func.__qualname__}".encode())
+    h.update(version.encode())
+    h.update(repr((args, sorted(kwargs.items()))).encode())
+    return h.hexdigest()
+
+
+def _evict(cache_dir, max_bytes):
+    """Removes the least recently used results until the cache fits max_bytes."""
+    entries = []
+    for path in cache_dir.glob("*.pkl"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue  # removed by another process
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def disk_cache(func):
+    """
+    Memoizes a function whose first argument is the panel on disk.
+    Calls with data that is not a Panel (e.g. a plain dict) are not cached.
+    """
+
+    @functools.wraps(func)
+    def wrapper(data, *args, **kwargs):
+        if not ENABLED or not isinstance(data, Panel):
+            return func(data, *args, **kwargs)
+
+        path = CACHE_DIR / f"{_cache_key(func, data.version, args, kwargs)}.pkl"
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+            os.utime(path)  # mark as recently used
+            return result
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            pass
+
+        result = func(data, *args, **kwargs)
+
+        # Write to a temporary file first so other processes never read half a file
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        _evict(CACHE_DIR, MAX_CACHE_BYTES)
+
+        return result
+
+    return wrapper
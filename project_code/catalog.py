@@ -0,0 +1,63 @@
+"""
+This module contains the indicator catalog: the World Bank code, slug (the
+name used for files and panel columns), display name, unit, polarity, map
+colour scale, group and description of every indicator, read from
+data/indicators.json. All modules read the indicators from the catalog, so
+adding an indicator is an edit of that file only.
+"""
+
+import json
+from functools import cache
+from pathlib import Path
+import pandas as pd
+
+CATALOG_PATH = Path(__file__).parent.parent / "data" / "indicators.json"
+DEFAULT_COLOR_SCALE = "Viridis"
+
+
+@cache  # the catalog is read once per process
+def load_catalog(path=CATALOG_PATH):
+    """Returns the indicator catalog as a DataFrame indexed by the World Bank code."""
+    with open(path, encoding="utf-8") as f:
+        catalog = pd.DataFrame(json.load(f))
+    if catalog["code"].duplicated().any() or catalog["slug"].duplicated().any():
+        raise ValueError(f"Duplicate indicator codes or slugs in {path}")
+    return catalog.set_index("code")
+
+
+def indicator_codes():
+    """Returns the World Bank codes of all indicators of the catalog."""
+    return list(load_catalog().index)
+
+
+def indicator_slugs():
+    """Returns the dict of World Bank code -> slug of all indicators."""
+    return load_catalog()["slug"].to_dict()
+
+
+def indicator_info(slug):
+    """Returns the catalog entry (name, unit, polarity...) of an indicator slug."""
+    catalog = load_catalog()
+    matches = catalog[catalog["slug"] == slug]
+    if matches.empty:
+        return None
+    return matches.iloc[0]
+
+
+def indicator_label(slug, unit=False):
+    """
+    Returns the display name of an indicator from the catalog, followed by its
+    unit in parentheses if unit is True (the slug in title case if not in it).
+    """
+    info = indicator_info(slug)
+    if info is None:
+        return slug.replace("_", " ").title()
+    if unit and info["unit"]:
+        return f"{info['name']} ({info['unit']})"
+    return info["name"]
+
+
+def color_scale(slug):
+    """Returns the map colour scale of an indicator (the default if not in the catalog)."""
+    info = indicator_info(slug)
+    return DEFAULT_COLOR_SCALE if info is None else info["color_scale"]
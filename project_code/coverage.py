@@ -0,0 +1,136 @@
+"""
+This module contains the coverage cube: a bitmap of which (series, economy,
+year) cells of the raw data are present, written by the ETL next to the panel
+store. Coverage policies - missing data thresholds for indicators and
+countries applied in any order - are vectorized reductions over the cube, so
+a threshold can change without re-reading the raw data or rerunning the ETL.
+"""
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from project_code.panel import PANEL_DIR, resolve_snapshot
+
+# The cleaning rules of the dashboard: drop indicators and then countries
+# with more than 30% of missing data
+DEFAULT_POLICY = [("indicators", 0.3), ("countries", 0.3)]
+
+
+def coverage_policy(max_missing):
+    """Returns the default policy with another missing data threshold."""
+    return [(axis, max_missing) for axis, _ in DEFAULT_POLICY]
+
+
+class Coverage:
+    """
+    Not-null bitmap cube of the raw data. bits: (series, economy, year) packed
+    along the years, rows: which (series, economy) pairs have a row in the
+    raw data (pairs without one do not count towards the missing fractions).
+    """
+
+    def __init__(self, bits, rows, series, economies, years):
+        self.bits = bits
+        self.rows = rows
+        self.series = np.asarray(series, dtype=object)
+        self.economies = np.asarray(economies, dtype=object)
+        self.years = np.asarray(years, dtype="int64")
+        # Present years per (series, economy), enough for every threshold
+        self.counts = self.present().sum(axis=-1)
+
+    @classmethod
+    def from_raw(cls, chunks):
+        """Builds the cube from chunks of raw data (economy, series, YR2000...)."""
+        keys, packed, years = [], [], None
+        for chunk in chunks:
+            year_cols = chunk.columns[2:]
+            years = year_cols.str.replace("YR", "").astype("int64")
+            keys.append(chunk[["series", "economy"]])
+            packed.append(np.packbits(chunk[year_cols].notna().to_numpy(), axis=1))
+        keys = pd.concat(keys, ignore_index=True)
+        packed = np.concatenate(packed)
+
+        series_idx, series = pd.factorize(keys["series"], sort=True)
+        economy_idx, economies = pd.factorize(keys["economy"], sort=True)
+        bits = np.zeros((len(series), len(economies), packed.shape[1]), dtype=np.uint8)
+        bits[series_idx, economy_idx] = packed
+        rows = np.zeros((len(series), len(economies)), dtype=bool)
+        rows[series_idx, economy_idx] = True
+        return cls(bits, rows, series, economies, years)
+
+    @classmethod
+    def open(cls, path=PANEL_DIR):
+        """Loads the cube saved with the panel store (None if there is none)."""
+        path = resolve_snapshot(path) / "coverage.npz"
+        if not path.exists():
+            return None
+        with np.load(path, allow_pickle=False) as f:
+            return cls(f["bits"], f["rows"], f["series"], f["economies"], f["years"])
+
+    def save(self, path=PANEL_DIR):
+        """Saves the cube next to the panel store."""
+        np.savez_compressed(
+            Path(path) / "coverage.npz",
+            bits=self.bits,
+            rows=self.rows,
+            series=self.series.astype(str),
+            economies=self.economies.astype(str),
+            years=self.years,
+        )
+
+    def present(self):
+        """Returns the unpacked (series, economy, year) boolean cube."""
+        return np.unpackbits(self.bits, axis=-1, count=len(self.years)).astype(bool)
+
+    def with_series(self, other):
+        """Returns the cube with the series of other added (on the economies of self)."""
+        new = ~np.isin(other.series, self.series)
+        position = pd.Index(other.economies).get_indexer(self.economies)
+        found = position >= 0
+        bits = np.zeros((new.sum(),) + self.bits.shape[1:], dtype=np.uint8)
+        bits[:, found] = other.bits[new][:, position[found]]
+        rows = np.zeros((new.sum(), len(self.economies)), dtype=bool)
+        rows[:, found] = other.rows[new][:, position[found]]
+        return Coverage(
+            np.concatenate([self.bits, bits]),
+            np.concatenate([self.rows, rows]),
+            np.concatenate([self.series, other.series[new]]),
+            self.economies,
+            self.years,
+        )
+
+    def missing_fraction(self, axis, series=None, economies=None):
+        """
+        Returns the missing fraction of every indicator (axis="indicators") or
+        country (axis="countries") over the kept series and economies (boolean
+        masks, all if None), NaN where there are no rows.
+        """
+        if series is None:
+            series = np.ones(len(self.series), dtype=bool)
+        if economies is None:
+            economies = np.ones(len(self.economies), dtype=bool)
+        counts = self.counts * series[:, None] * economies[None, :]
+        rows = self.rows * series[:, None] * economies[None, :]
+        sum_axis = 1 if axis == "indicators" else 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return 1 - counts.sum(axis=sum_axis) / (
+                rows.sum(axis=sum_axis) * len(self.years)
+            )
+
+    def apply(self, policy=DEFAULT_POLICY):
+        """
+        Applies a coverage policy, a list of ("indicators" or "countries",
+        threshold) steps in order: each step drops the indicators or countries
+        with more than threshold of missing data over what is still kept.
+        Returns the kept series codes and economies.
+        """
+        series = np.ones(len(self.series), dtype=bool)
+        economies = np.ones(len(self.economies), dtype=bool)
+        for axis, threshold in policy:
+            missing = self.missing_fraction(axis, series, economies)
+            if axis == "indicators":
+                series &= ~(missing > threshold)
+            elif axis == "countries":
+                economies &= ~(missing > threshold)
+            else:
+                raise ValueError(f"Unknown coverage policy axis: {axis}")
+        return list(self.series[series]), list(self.economies[economies])
@@ -1,47 +1,81 @@
 """
 This module contains functions for cleaning the data from the indicators
-and countries with high level of missing data, splitting data to separate
-csv files creating a long format data and loading data into a dictionary.
+and countries with high level of missing data and reshaping it into the
+panel store, loading the panel store and (for debugging) splitting data to
+separate csv files and creating a long format data. The raw data is streamed
+in chunks: one pass counts the missing cells, a second one keeps the rows.
 """
 
 import os
 import glob
-from pathlib import Path
-import time
+from functools import cache
 import streamlit as st
+import numpy as np
 import pandas as pd
-import pycountry
+from project_code.catalog import indicator_slugs
+from project_code.coverage import DEFAULT_POLICY, Coverage, coverage_policy
+from project_code.instrumentation import timed
+from project_code.panel import (
+    PANEL_DIR,
+    Panel,
+    create_panel_store,
+    discard_staging,
+    publish_snapshot,
+    refresh_setup_lock,
+    resolve_snapshot,
+    staging_dir,
+    write_panel_store,
+)
 
+RAW_PATH = "data/raw/all_indicators.csv"
+# World Bank name and region of the economies, saved by collect_data
+ECONOMIES_PATH = "data/raw/economies.csv"
+CLEANED_PATH = "data/cleaned/all_indicators_cleaned.csv"
+CHUNK_SIZE = 100_000  # rows of the raw data read at once
+MAX_MISSING = 0.3  # default share of missing data allowed per indicator and country
+
+# Readable names (slugs) of the indicators used for files and panel columns
+INDICATOR_NAMES = indicator_slugs()
 
-def clean_data():
-    """Cleans the raw data - removing indicators and countries with significant missing data."""
 
-    # Load raw data
-    df = pd.read_csv("data/raw/all_indicators.csv")
+def missing_counts(df):
+    """
+    Counts the missing and all year cells of every (series, economy) pair
+    of raw data (economy, series, YR2000...) with vectorized sums.
+    """
     # Select only the numeric columns (years)
     year_cols = df.columns[2:]
+    counts = pd.DataFrame(
+        {
+            "series": df["series"].to_numpy(),
+            "economy": df["economy"].to_numpy(),
+            "missing": df[year_cols].isna().sum(axis=1).to_numpy(),
+            "cells": len(year_cols),
+        }
+    )
+    return counts.groupby(["series", "economy"]).sum()
 
-    treshold = 0.3  # 30% missing data allowed
 
-    # Sort indicators by missing fraction in descending order
-    missing_per_ind = df.groupby("series")[year_cols].apply(
-        lambda x: x.isna().mean().mean()
-    )
+def low_coverage(counts, treshold=0.3):
+    """
+    Returns the indicators and then the countries (of the remaining
+    indicators) with more than treshold of missing data.
+    counts: missing and all cells per (series, economy), see missing_counts
+    """
+    # Missing fraction per indicator
+    per_ind = counts.groupby(level="series").sum()
+    missing_per_ind = per_ind["missing"] / per_ind["cells"]
 
     # Drop least covered ones
     print(
         f"Indicators with over 30% of missing data {missing_per_ind[missing_per_ind > treshold]}"
     )
     low_data_indicators = missing_per_ind[missing_per_ind > treshold].index
-    df_clean1 = df[~df["series"].isin(low_data_indicators)]
-
-    # Select only the numeric columns (years)
-    year_cols = df_clean1.columns[2:]
 
     # Calculate missing fraction per country
-    missing_per_country = df_clean1.groupby("economy")[year_cols].apply(
-        lambda x: x.isna().mean().mean()
-    )
+    kept = counts[~counts.index.get_level_values("series").isin(low_data_indicators)]
+    per_country = kept.groupby(level="economy").sum()
+    missing_per_country = per_country["missing"] / per_country["cells"]
 
     # Drop countries with too much missing data
     print(
@@ -49,18 +83,181 @@ def clean_data():
         f"{missing_per_country[missing_per_country > treshold]}"
     )
     low_data_countries = missing_per_country[missing_per_country > treshold].index
-    df_clean2 = df_clean1[~df_clean1["economy"].isin(low_data_countries)]
+    return low_data_indicators, low_data_countries
+
+
+def read_raw_chunks(path=RAW_PATH, chunksize=CHUNK_SIZE):
+    """Reads the raw data in chunks of chunksize rows."""
+    return pd.read_csv(path, chunksize=chunksize, keep_default_na=False, na_values=[""])
+
+
+def refreshing_lock(chunks, path=PANEL_DIR):
+    """Yields the chunks, refreshing the setup lock of the store at path for each."""
+    for chunk in chunks:
+        refresh_setup_lock(path)
+        yield chunk
+
 
-    path = "data/cleaned/all_indicators_cleaned.csv"
-    df_clean2.to_csv(path, index=False)
-    print(f"Cleaned data saved to {path}")
+def filtered_chunks(path=RAW_PATH, chunksize=CHUNK_SIZE):
+    """
+    Streams the raw data without the indicators and countries with significant
+    missing data in two passes over the file: the first one counts the missing
+    cells, the second one yields the kept rows chunk by chunk. Memory is bounded
+    by the chunk size and the counts, not by the size of the file.
+    """
+    counts = None
+    for chunk in read_raw_chunks(path, chunksize):
+        chunk_counts = missing_counts(chunk)
+        counts = (
+            chunk_counts if counts is None else counts.add(chunk_counts, fill_value=0)
+        )
+    low_data_indicators, low_data_countries = low_coverage(counts)
+
+    for chunk in read_raw_chunks(path, chunksize):
+        yield chunk[
+            ~chunk["series"].isin(low_data_indicators)
+            & ~chunk["economy"].isin(low_data_countries)
+        ]
+
+
+def to_long(df):
+    """Reshapes cleaned data (economy, series, YR2000...) to economy, series, year, value."""
+    long_df = df.melt(id_vars=["economy", "series"], var_name="year")
+    long_df["year"] = long_df["year"].str.replace("YR", "").astype("int64")
+    long_df["series"] = long_df["series"].map(INDICATOR_NAMES).fillna(long_df["series"])
+    return long_df
+
+
+def long_to_panel(long_df):
+    """Pivots long data (economy, series, year, value) to the wide panel."""
+    wide = long_df.pivot(index=["economy", "year"], columns="series", values="value")
+    wide.columns.name = None
+    return wide.reset_index()
+
+
+def scatter_chunk(values, chunk, economies, years, indicators):
+    """
+    Writes a chunk of raw data (economy, series, YR2000...) into its cells of
+    a panel store created by create_panel_store with the given index values.
+    """
+    year_cols = chunk.columns[2:]
+    year_idx = years.get_indexer(year_cols.str.replace("YR", "").astype("int64"))
+    economy_idx = economies.get_indexer(chunk["economy"])
+    series = chunk["series"].map(INDICATOR_NAMES).fillna(chunk["series"])
+    rows = year_idx[None, :] * len(economies) + economy_idx[:, None]
+    cols = indicators.get_indexer(series)[:, None]
+    values[rows, cols] = chunk[year_cols].to_numpy(dtype="float64")
+
+
+@timed("etl.build_panel")
+def build_panel(debug=False, chunksize=CHUNK_SIZE, path=PANEL_DIR, raw_path=RAW_PATH):
+    """
+    Streams the raw data in chunks into a new snapshot of the panel store
+    and its coverage cube. The first pass builds the coverage cube, which
+    fixes the economies, years and indicators of the store, the second one
+    writes every chunk into its cells of the memory-mapped store, so memory
+    is bounded by the chunk size, not by the size of the data.
+    The store keeps all indicators and countries, the missing data thresholds
+    are applied when it is loaded (see load_indicator_data), so they can
+    change without rerunning the ETL.
+    The snapshot is built in a staging folder and published only when it is
+    complete, running dashboards pick it up on their next rerun.
+    debug: If True, also writes the intermediate cleaned (with the default
+    thresholds), per-indicator and long-format CSV files.
+    raw_path: raw data (economy, series, YR2000...) collected by collect_data
+    """
+    staging = staging_dir(path)
+    try:
+        coverage = Coverage.from_raw(
+            refreshing_lock(read_raw_chunks(raw_path, chunksize), path)
+        )
+        economies = pd.Index(coverage.economies)
+        years = pd.Index(np.sort(coverage.years))
+        series = pd.Series(coverage.series)
+        indicators = pd.Index(sorted(set(series.map(INDICATOR_NAMES).fillna(series))))
+
+        values = create_panel_store(
+            staging, economies, years, indicators, economy_table=economy_table()
+        )
+        for chunk in refreshing_lock(read_raw_chunks(raw_path, chunksize), path):
+            scatter_chunk(values, chunk, economies, years, indicators)
+        values.flush()
+        del values
+        coverage.save(staging)
+        print(f"Panel store saved to {staging}")
+    except BaseException:
+        discard_staging(staging)
+        raise
+    publish_snapshot(staging, path)
+
+    series, economies = coverage.apply(DEFAULT_POLICY)
+    print(
+        f"With the default thresholds {len(series)} of {len(coverage.series)} "
+        f"indicators and {len(economies)} of {len(coverage.economies)} countries are kept"
+    )
+
+    if debug:
+        clean_data(chunksize)
+        split_data()
+        long_format_data()
+
+
+@timed("etl.add_indicators")
+def add_indicators(codes, path=PANEL_DIR, chunksize=CHUNK_SIZE):
+    """
+    Adds the given series to the panel store and coverage cube without
+    rebuilding them: only their rows are read from the raw data and the
+    economies of the panel are kept (run build_panel to add others). The
+    result is published as a new snapshot of the store.
+    Returns the slugs of the added indicators.
+    """
+    panel = Panel.open(path)
+    economies = set(panel.economy_table["code"])
+
+    parts = []
+    for chunk in refreshing_lock(read_raw_chunks(RAW_PATH, chunksize), path):
+        parts.append(
+            chunk[chunk["series"].isin(codes) & chunk["economy"].isin(economies)]
+        )
+    df = pd.concat(parts, ignore_index=True)
+    if df.empty:
+        print(f"No raw data for {codes}")
+        return []
+    new = long_to_panel(to_long(df))
+    new = new.drop(columns=[c for c in new.columns if c in panel.indicators])
+
+    staging = staging_dir(path)
+    try:
+        # Left join keeps the (economy, year) rows of the panel
+        wide = panel.to_wide().merge(new, on=["economy", "year"], how="left")
+        write_panel_store(wide, staging, economy_table=panel.economy_table)
+        coverage = Coverage.open(path)
+        if coverage is not None:
+            coverage.with_series(Coverage.from_raw([df])).save(staging)
+    except BaseException:
+        discard_staging(staging)
+        raise
+    publish_snapshot(staging, path)
+    return [c for c in new.columns if c not in ["economy", "year"]]
+
+
+def clean_data(chunksize=CHUNK_SIZE):
+    """Cleans the raw data - removing indicators and countries with significant missing data."""
+    # Stream the raw data and append the kept rows of every chunk
+    header = True
+    for chunk in filtered_chunks(RAW_PATH, chunksize):
+        chunk.to_csv(
+            CLEANED_PATH, index=False, mode="w" if header else "a", header=header
+        )
+        header = False
+    print(f"Cleaned data saved to {CLEANED_PATH}")
 
 
 def split_data():
     """Splits the cleaned data into separate files per indicator."""
 
     # Load cleaned data
-    df = pd.read_csv("data/cleaned/all_indicators_cleaned.csv")
+    df = pd.read_csv(CLEANED_PATH)
     for indicator, subset in df.groupby("series"):
         # Clean year columns to contain only year number
         subset.columns = subset.columns.str.replace("YR", "")
@@ -69,25 +266,7 @@ def split_data():
         subset = subset.drop(columns=["series"])
 
         # Create readable filename
-        indicator_names = {
-            "AG.LND.FRST.ZS": "forest_area",
-            "EG.FEC.RNEW.ZS": "renewable_energy",
-            "EN.ATM.PM25.MC.M3": "pm25_pollution",
-            "EN.GHG.ALL.PC.CE.AR5": "ghg_per_capita",
-            "EN.GHG.CO2.PC.CE.AR5": "co2_per_capita",
-            "EN.GHG.CO2.RT.GDP.PP.KD": "carbon_intensity",
-            "NY.GDP.MKTP.KD.ZG": "gdp_growth",
-            "NY.GDP.PCAP.PP.KD": "gdp_per_capita",
-            "SH.DYN.MORT": "child_mortality",
-            "SH.XPD.CHEX.GD.ZS": "health_exp_pct_gdp",
-            "SH.XPD.CHEX.PC.CD": "health_exp_per_capita",
-            "SP.DYN.LE00.IN": "life_expectancy",
-            "SP.POP.GROW": "population_growth",
-            "SP.POP.TOTL": "population",
-            "SP.URB.TOTL.IN.ZS": "urban_population",
-        }
-
-        filename = indicator_names.get(indicator)
+        filename = INDICATOR_NAMES.get(indicator)
         path = f"data/cleaned/{filename}.csv"
         subset.to_csv(path, index=False)
         print(f"Saved: {path}")
@@ -106,42 +285,91 @@ def long_format_data():
         long_df.to_csv(f"data/long/{name}_long.csv", index=False)
 
 
-def rename_economies(df):
-    """Renames 3-letter country codes to full country names in the 'economy' column."""
-    df = df.copy()
-    # Create mapping dictionary
+@cache  # pycountry is scanned once per process
+def economy_names():
+    """Returns the dict of 3-letter country codes to full country names."""
+    import pycountry  # only needed when economy names are generated
+
     code_to_country = {}
     for c in pycountry.countries:
         if hasattr(c, "alpha_3"):
             code_to_country[c.alpha_3] = c.name
-    # Map codes to names
-    df["economy"] = df["economy"].map(code_to_country).fillna(df["economy"])
-    return df
+    return code_to_country
 
 
-@st.cache_data  # Streamlit will cache the result
-def load_indicator_data(rename_countries=True):
+def economy_table():
     """
-    Loads all long-format indicator CSVs into a dictionary of DataFrames.
-    rename_countries: If True, converts country codes to names.
+    Returns the code, name and region of the economies, generated once at ETL
+    time and stored with the panel. Names are the pycountry names (or the
+    World Bank names for codes pycountry does not know), regions come from
+    the World Bank economy list if it was collected.
     """
-    time.sleep(1)  # Simulate a delay for loading data
-    project_root = Path(__file__).parent.parent
-    data_path = project_root / "data" / "long"
-    csv_files = glob.glob(str(data_path / "*.csv"))
+    if os.path.exists(ECONOMIES_PATH):
+        table = pd.read_csv(ECONOMIES_PATH, keep_default_na=False)
+    else:
+        table = pd.DataFrame(columns=["code", "name", "region"])
 
-    data = {}
-    for f in csv_files:
-        if os.path.basename(f) == "all_indicators_cleaned_long.csv":
-            continue
-        name = os.path.splitext(os.path.basename(f))[0]
-        name = name.replace("_long", "")
-        df = pd.read_csv(f)
-        # Rename countries only when needed (keeps codes for map so the function
-        # can recognise it but shows full names in scatterplots)
-        if rename_countries:
-            df = rename_economies(df)
+    names = pd.Series(economy_names(), name="name")
+    codes = names.index.union(table["code"])
+    table = table.set_index("code").reindex(codes)
+    table["name"] = names.reindex(codes).fillna(table["name"])
+    table["region"] = table["region"].fillna("")
+    return table.rename_axis("code").reset_index()
+
+
+@st.cache_resource(max_entries=4)  # one shared read-only panel per snapshot
+def open_panel_store(path=PANEL_DIR):
+    """Attaches the memory-mapped panel store (once per process and snapshot)."""
+    return Panel.open(path)
+
+
+@st.cache_resource(max_entries=4)  # the coverage cube is read once per snapshot
+def open_coverage(path=PANEL_DIR):
+    """Loads the coverage cube of the panel store (None for stores without one)."""
+    return Coverage.open(path)
+
+
+def load_indicator_data(rename_countries=True, path=PANEL_DIR, max_missing=MAX_MISSING):
+    """
+    Returns a read-only mapping of indicator name to a long-format DataFrame
+    (frames are built on first access) over the shared panel store.
+    rename_countries: If True, labels economies with the country names.
+    path: Folder of the panel store, its current snapshot is loaded, so a
+    newly published snapshot is used from the next rerun without a restart.
+    max_missing: Indicators and then countries with a larger share of missing
+    data are left out (read from the coverage cube, no data is re-read).
+    """
+    return load_snapshot(resolve_snapshot(path), rename_countries, max_missing)
+
+
+@st.cache_resource(max_entries=8)
+def load_snapshot(snapshot, rename_countries=True, max_missing=MAX_MISSING):
+    """Loads the panel of one snapshot folder (see load_indicator_data)."""
+    panel = threshold_panel(snapshot, max_missing)
+
+    # Rename countries only when needed (keeps codes for map so the function
+    # can recognise it but shows full names in scatterplots). Both versions
+    # share the values, only the economy labels differ.
+    if rename_countries:
+        panel = panel.with_economy_labels(panel.economy_table["name"])
 
-        data[name] = df
+    return panel
+
+
+@st.cache_resource(max_entries=4)
+def threshold_panel(snapshot, max_missing=MAX_MISSING):
+    """
+    Returns the panel of a snapshot with the indicators and countries kept by
+    the missing data threshold, selected over the shared store (no copy),
+    once per snapshot and threshold for both economy labellings.
+    """
+    panel = open_panel_store(snapshot)
+    coverage = open_coverage(snapshot)
+    if coverage is not None:
+        series, economies = coverage.apply(coverage_policy(max_missing))
+        slugs = {INDICATOR_NAMES.get(code, code) for code in series}
+        panel = panel.subset([i for i in panel.indicators if i in slugs], economies)
 
-    return data
+    # Built once here, so the pages read slider bounds without scanning the data
+    panel.metadata
+    return panel
@@ -1,72 +1,294 @@
 """
 This module contains collec_data function which collects the data
 for the indicators chosen after the analysis explained in the
-project_analysis.ipynb from the World Bank API.
+project_analysis.ipynb from the World Bank API. The data is synced
+incrementally: a fetch log records when every (indicator, economy, year)
+cell was downloaded and only missing or stale cells are requested again.
+Requests run concurrently per indicator and economy chunk with retries,
+failed chunks stay stale and are the only ones fetched on the next run.
 """
 
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 import wbgapi as wb
 import pandas as pd
+from project_code.catalog import indicator_codes
 
-def collect_data():
-    """Collects raw data from the World Bank API and saves it to a CSV file."""
+RAW_PATH = "data/raw/all_indicators.csv"
+FETCH_LOG_PATH = "data/raw/fetch_log.csv"
+ECONOMIES_PATH = "data/raw/economies.csv"
+YEARS = range(2000, 2024)
 
+# World Bank codes of the indicators from the catalog (data/indicators.json)
+INDICATORS = indicator_codes()
+
+
+def filter_economies(client=wb, min_pop=5000000, economies=None):
+    """
+    Returns the non-aggregate economies with population over min_pop.
+    economies: the economy list of the client if it was already fetched.
+    """
+    if economies is None:
+        economies = with_retry(lambda: list(client.economy.list()))
     # Getting list of non-aggregate economies
-    non_aggregates = [e for e in wb.economy.list() if not e["aggregate"]]
+    non_aggregates = [e for e in economies if not e["aggregate"]]
     economy_ids = [e["id"] for e in non_aggregates]
 
     # Filtering economies with population > 5 million
-    min_pop = 5000000  # minimum population
-    pop_data = wb.data.DataFrame("SP.POP.TOTL", economy_ids)
+    pop_data = with_retry(client.data.DataFrame, "SP.POP.TOTL", economy_ids)
 
     # Selecting countries satisfying the population criterion for the last available year
-    filtered_countries = pop_data.index[pop_data.iloc[:, -1] >= min_pop].tolist()
-
-    indicators = [
-        "EN.GHG.ALL.PC.CE.AR5",
-        "EN.GHG.CO2.PC.CE.AR5",
-        "EN.ATM.PM25.MC.M3",
-        "EN.GHG.CO2.RT.GDP.PP.KD",
-        "NY.GDP.PCAP.PP.KD",
-        "NY.GDP.MKTP.KD.ZG",
-        "SP.DYN.LE00.IN",
-        "SH.DYN.MORT",
-        "SH.XPD.CHEX.GD.ZS",
-        "SH.XPD.CHEX.PC.CD",
-        "AG.LND.FRST.ZS",
-        "SH.H2O.SMDW.ZS",
-        "SH.STA.AIRP.P5",
-        "EG.FEC.RNEW.ZS",
-        "SH.STA.WASH.P5",
-        "SP.POP.GROW",
-        "SP.POP.TOTL",
-        "SP.URB.TOTL.IN.ZS",
-    ]
+    return pop_data.index[pop_data.iloc[:, -1] >= min_pop].tolist()
+
+
+def write_csv(df, path, **kwargs):
+    """
+    Writes df to a CSV file through a temporary file replaced atomically, so
+    other processes never read a half-written file.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        df.to_csv(tmp_path, **kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def save_economies(economies, path=ECONOMIES_PATH):
+    """Saves the code, World Bank name and region of the non-aggregate economies."""
+    table = pd.DataFrame(
+        [
+            {"code": e["id"], "name": e["value"], "region": e.get("region") or ""}
+            for e in economies
+            if not e["aggregate"]
+        ],
+        columns=["code", "name", "region"],
+    )
+    write_csv(table, path, index=False)
+    print(f"Economies saved to {path}")
+
+
+def load_fetch_log(path=FETCH_LOG_PATH):
+    """Loads the log of fetched (series, economy, year) cells and their fetch time."""
+    if not os.path.exists(path):
+        return pd.DataFrame(
+            {
+                "series": pd.Series(dtype="object"),
+                "economy": pd.Series(dtype="object"),
+                "year": pd.Series(dtype="int64"),
+                "fetched_at": pd.Series(dtype="datetime64[ns]"),
+            }
+        )
+    return pd.read_csv(path, parse_dates=["fetched_at"])
+
+
+def load_raw_data(path=RAW_PATH):
+    """Loads the raw store indexed by (economy, series), empty if missing or invalid."""
+    if os.path.exists(path):
+        df = pd.read_csv(path)
+        if "economy" in df.columns and "series" in df.columns:
+            return df.set_index(["economy", "series"])
+    return pd.DataFrame(
+        index=pd.MultiIndex.from_tuples([], names=["economy", "series"])
+    )
+
+
+def stale_cells(log, indicators, economies, years, max_age, now):
+    """
+    Returns the (series, economy, year) cells that were never fetched
+    or were fetched longer than max_age ago (only the never fetched ones
+    if max_age is None).
+    """
+    wanted = pd.MultiIndex.from_product(
+        [indicators, economies, years], names=["series", "economy", "year"]
+    ).to_frame(index=False)
+    cells = wanted.merge(log, on=["series", "economy", "year"], how="left")
+    stale = cells["fetched_at"].isna()
+    if max_age is not None:
+        stale |= now - cells["fetched_at"] > max_age
+    return cells.loc[stale, ["series", "economy", "year"]]
+
+
+def fetch_requests(cells, chunk_size=50):
+    """
+    Groups cells into requests of (series, economies, years): economies that
+    miss the same range of years of a series are fetched together, in chunks
+    of at most chunk_size economies.
+    """
+    ranges = cells.groupby(["series", "economy"])["year"].agg(["min", "max"])
+    requests = []
+    for (series, first, last), group in ranges.reset_index().groupby(
+        ["series", "min", "max"]
+    ):
+        economies = sorted(group["economy"])
+        for i in range(0, len(economies), chunk_size):
+            chunk = economies[i : i + chunk_size]
+            requests.append((series, chunk, range(first, last + 1)))
+    return requests
+
+
+def with_retry(func, *args, retries=3, backoff=1.0, **kwargs):
+    """
+    Calls func and retries it on failure, waiting an exponentially growing
+    and randomly jittered time between the attempts.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2**attempt * random.uniform(0.5, 1.5))
+
+
+def fetch(client, series, economies, years):
+    """Fetches one series for the given economies and years (rows: economy, series)."""
+    return with_retry(
+        client.data.DataFrame,
+        [series],
+        economies,
+        time=years,
+        index=["economy", "series"],
+        columns="time",
+    )
+
+
+def sync_data(
+    economies,
+    indicators=INDICATORS,
+    years=YEARS,
+    client=wb,
+    max_age_days=30,
+    max_workers=4,
+    raw_path=RAW_PATH,
+    log_path=FETCH_LOG_PATH,
+    progress=None,
+):
+    """
+    Fetches only the missing or stale cells on a pool of max_workers threads
+    and merges the successful requests into the raw store.
+    client: the wbgapi module or any object with the same economy.list() and
+    data.DataFrame() interface (e.g. a local fake for testing).
+    max_age_days: None to fetch only the cells never fetched before.
+    progress: called after every finished request (e.g. to refresh the setup lock).
+    """
+    now = pd.Timestamp(datetime.now())
+    log = load_fetch_log(log_path)
+    raw = load_raw_data(raw_path)
+
+    max_age = None if max_age_days is None else timedelta(days=max_age_days)
+    cells = stale_cells(log, indicators, economies, years, max_age, now)
+    requests = fetch_requests(cells)
+    print(f"{len(cells)} missing or stale cells, {len(requests)} requests to send")
+
+    fetched = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(fetch, client, *request): request for request in requests
+        }
+        for future in as_completed(futures):
+            if progress is not None:
+                progress()
+            series, request_economies, request_years = futures[future]
+            try:
+                new = future.result()
+            except Exception as e:
+                # Not logged as fetched, so only this request is repeated next time
+                failed.append(futures[future])
+                print(
+                    f"⚠ Failed to fetch {series} ({len(request_economies)} economies): {e}"
+                )
+                continue
+
+            # Overwrite the fetched cells in the raw store
+            raw = raw.reindex(raw.index.union(new.index))
+            for col in new.columns:
+                if col not in raw.columns:
+                    raw[col] = float("nan")
+            raw.loc[new.index, new.columns] = new.to_numpy()
+
+            fetched.append(
+                pd.MultiIndex.from_product(
+                    [[series], request_economies, request_years],
+                    names=["series", "economy", "year"],
+                ).to_frame(index=False)
+            )
+
+    # Series no longer selected are removed from the raw store below, so they
+    # are forgotten in the log too and fetched again if they are added back
+    dropped = ~log["series"].isin(indicators)
+    if fetched or dropped.any():
+        log = log[~dropped]
+        if fetched:
+            fetched = pd.concat(fetched, ignore_index=True)
+            fetched["fetched_at"] = now
+            if not log.empty:
+                fetched = pd.concat([log, fetched]).drop_duplicates(
+                    subset=["series", "economy", "year"], keep="last"
+                )
+            log = fetched
+        write_csv(log, log_path, index=False)
+
+    # Keep only the selected economies and indicators, years in order
+    year_cols = [f"YR{year}" for year in years]
+    selected = pd.MultiIndex.from_product(
+        [economies, indicators], names=["economy", "series"]
+    )
+    raw = raw.reindex(index=selected.intersection(raw.index), columns=year_cols)
+    write_csv(raw.sort_index(), raw_path)
+    print(f"Raw data saved to {raw_path}")
+    if failed:
+        print(
+            f"⚠ {len(failed)} of {len(requests)} requests failed, rerun to fetch them"
+        )
+    return failed
+
+
+def collect_data(client=wb, max_age_days=30, progress=None):
+    """
+    Collects raw data from the World Bank API and saves it to a CSV file.
+    progress: called after every finished request (see sync_data).
+    """
+
+    economies = with_retry(lambda: list(client.economy.list()))
+    save_economies(economies)
+    filtered_countries = filter_economies(client, economies=economies)
 
     print(
         "Collecting data from World Bank API this may take a while have a cup of coffee..."
     )
-    data = wb.data.DataFrame(indicators, filtered_countries, time=range(2000, 2024))
-    path = "data/raw/all_indicators.csv"
-    data.to_csv(path)
-    print(f"Raw data saved to {path}")
+    sync_data(
+        filtered_countries,
+        client=client,
+        max_age_days=max_age_days,
+        progress=progress,
+    )
 
 
 def ensure_valid_raw_data():
     """
-    Ensures that the raw data file contains economy and series columns.
-    If not, replaces it with the backup version.
+    Ensures that the raw data file contains economy and series columns and
+    some data. If not, replaces it with the backup version.
     """
     csv_path = "data/raw/all_indicators.csv"
     backup_path = "data/raw/raw_data_backup.txt"
     df = pd.read_csv(csv_path)
-    
+
     # Check the structure
-    if "economy" in df.columns and "series" in df.columns:
+    if "economy" in df.columns and "series" in df.columns and not df.empty:
         print("✔ Raw data structure is valid.")
         return
     else:
-        print("⚠ Raw data missing required columns. Restoring backup...")
+        print("⚠ Raw data missing required columns or empty. Restoring backup...")
         backup_df = pd.read_csv(backup_path)
         # Save backup over wrong CSV
-        backup_df.to_csv(csv_path, index=False)
+        write_csv(backup_df, csv_path, index=False)
         print("🔄 Raw data restored from backup.")
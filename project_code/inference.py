@@ -0,0 +1,286 @@
+"""
+This module contains the resampling inference of the dashboard: bootstrap
+confidence intervals and permutation p-values for correlations, partial
+correlations and fixed effects regression slopes. Countries are resampled
+as whole blocks, every batch of replicates is computed in one vectorized
+step. The batches run serially unless the work is large enough to pay for
+a shared process pool. Each batch draws from its own seed spawned from the
+given seed, so results do not depend on the number of workers.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+from project_code.analysis import _demean
+from project_code.cache import disk_cache
+from project_code.instrumentation import timed
+from project_code.utils import merge_indicators
+
+N_REPLICATES = 2000
+BATCH_SIZE = 500  # replicates computed in one vectorized step
+MAX_WORKERS = 4
+# Resampled rows x replicates from which the batches run on the process pool,
+# below it (about 150 ms of serial work) a pool round trip costs more
+PARALLEL_MIN_WORK = 5_000_000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    """
+    Returns the process pool shared by all calls, started on first use. Its
+    workers are spawned, not forked from the threads of the Streamlit server.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=min(MAX_WORKERS, os.cpu_count() or 1),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _run_batches(
+    kernel, n_replicates, seed, n_rows, workers=None, batch_size=BATCH_SIZE
+):
+    """
+    Runs kernel(size, seed) for batches of replicates and concatenates the
+    results. workers: 1 runs the batches serially, more on the shared process
+    pool, None on the pool only if n_rows * n_replicates is PARALLEL_MIN_WORK
+    or more (and there is more than one CPU).
+    """
+    n_batches = -(-n_replicates // batch_size)
+    sizes = [batch_size] * (n_batches - 1) + [
+        n_replicates - batch_size * (n_batches - 1)
+    ]
+    seeds = np.random.SeedSequence(seed).spawn(n_batches)
+    if workers is None:
+        large = n_rows * n_replicates >= PARALLEL_MIN_WORK
+        workers = MAX_WORKERS if large and (os.cpu_count() or 1) > 1 else 1
+
+    if workers == 1 or n_batches == 1:
+        results = [kernel(size, s) for size, s in zip(sizes, seeds)]
+    else:
+        results = list(_executor().map(kernel, sizes, seeds))
+    return np.concatenate(results)
+
+
+def _row_corr(x, y):
+    """Pearson correlation of every row of x with the same row of y."""
+    x = x - x.mean(axis=1, keepdims=True)
+    y = y - y.mean(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = (x * y).sum(axis=1) / np.sqrt((x**2).sum(axis=1) * (y**2).sum(axis=1))
+    return np.clip(corr, -1, 1)
+
+
+def _partial_from_corr(r_xy, r_xz, r_yz):
+    """Partial correlation of x and y controlling for z from the pairwise correlations."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (r_xy - r_xz * r_yz) / np.sqrt((1 - r_xz**2) * (1 - r_yz**2))
+
+
+def _bootstrap_corr(x, y, z, size, seed):
+    """Correlations (partial if z is given) of size resamples of the countries."""
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(x), size=(size, len(x)))
+    r_xy = _row_corr(x[idx], y[idx])
+    if z is None:
+        return r_xy
+    return _partial_from_corr(
+        r_xy, _row_corr(x[idx], z[idx]), _row_corr(y[idx], z[idx])
+    )
+
+
+def _permutation_corr(x, y, size, seed):
+    """Correlations of x with size random permutations of y."""
+    rng = np.random.default_rng(seed)
+    perm = rng.permuted(np.tile(np.arange(len(y)), (size, 1)), axis=1)
+    return _row_corr(np.broadcast_to(x, perm.shape), y[perm])
+
+
+def _bootstrap_slopes(xtx, xty, size, seed):
+    """
+    Slopes of size country-block bootstrap samples. A resample is a vector of
+    how many times each country is drawn, so its slopes are the weighted sums
+    of the per-country cross products xtx (G, K, K) and xty (G, K).
+    """
+    rng = np.random.default_rng(seed)
+    n_groups = len(xtx)
+    weights = rng.multinomial(n_groups, np.full(n_groups, 1 / n_groups), size=size)
+    a = np.einsum("sg,gkl->skl", weights, xtx)
+    b = np.einsum("sg,gk->sk", weights, xty)
+    return (np.linalg.pinv(a) @ b[..., None])[..., 0]
+
+
+def _signflip_slopes(xtx_inv, scores, size, seed):
+    """
+    Slopes under the null of a zero slope (Freedman-Lane): the residuals of
+    the model without regressor j are sign-flipped per country. scores
+    (K, G, K) are the per-country cross products of X with those residuals,
+    so slope j of a replicate is a signed sum of them.
+    """
+    rng = np.random.default_rng(seed)
+    signs = rng.choice([-1.0, 1.0], size=(size, scores.shape[1]))
+    return np.einsum("sg,jgk,jk->sj", signs, scores, xtx_inv)
+
+
+def _percentile_ci(replicates, alpha=0.05):
+    """Percentile bootstrap interval of every column of replicates."""
+    return (
+        np.nanpercentile(replicates, 100 * alpha / 2, axis=0),
+        np.nanpercentile(replicates, 100 * (1 - alpha / 2), axis=0),
+    )
+
+
+def _permutation_pvalue(null, estimate):
+    """Two-sided permutation p-value of estimate against the null replicates."""
+    extreme = np.sum(np.abs(null) >= np.abs(estimate) - 1e-12, axis=0)
+    return (1 + extreme) / (1 + len(null))
+
+
+@timed("inference.correlation_inference")
+@disk_cache
+def correlation_inference(
+    data,
+    indicator_x,
+    indicator_y,
+    year,
+    control=None,
+    n_replicates=N_REPLICATES,
+    seed=0,
+    workers=None,
+):
+    """
+    Bootstrap confidence interval and permutation p-value of the correlation
+    of two indicators in a year (partial correlation if control is given).
+    Returns a Series with the estimate, CI 2.5%, CI 97.5%, p-value and n.
+    """
+    indicators = [indicator_x, indicator_y] + ([control] if control else [])
+    df, val_cols = merge_indicators(data, indicators, year=year)
+    x = df[val_cols[indicator_x]].to_numpy(dtype=float)
+    y = df[val_cols[indicator_y]].to_numpy(dtype=float)
+    z = df[val_cols[control]].to_numpy(dtype=float) if control else None
+
+    if len(df) < 4:
+        return pd.Series(
+            {
+                "estimate": np.nan,
+                "CI 2.5%": np.nan,
+                "CI 97.5%": np.nan,
+                "p-value": np.nan,
+                "n": len(df),
+            }
+        )
+
+    if z is None:
+        estimate = _row_corr(x[None], y[None])[0]
+        x_perm, y_perm = x, y
+    else:
+        estimate = _partial_from_corr(
+            _row_corr(x[None], y[None]),
+            _row_corr(x[None], z[None]),
+            _row_corr(y[None], z[None]),
+        )[0]
+        # Permute the parts of x and y not explained by the control
+        design = np.column_stack([np.ones_like(z), z])
+        x_perm = x - design @ np.linalg.lstsq(design, x, rcond=None)[0]
+        y_perm = y - design @ np.linalg.lstsq(design, y, rcond=None)[0]
+
+    boot = _run_batches(
+        partial(_bootstrap_corr, x, y, z), n_replicates, seed, len(df), workers
+    )
+    null = _run_batches(
+        partial(_permutation_corr, x_perm, y_perm),
+        n_replicates,
+        seed + 1,
+        len(df),
+        workers,
+    )
+    low, high = _percentile_ci(boot)
+    return pd.Series(
+        {
+            "estimate": estimate,
+            "CI 2.5%": low,
+            "CI 97.5%": high,
+            "p-value": _permutation_pvalue(null, estimate),
+            "n": len(df),
+        }
+    )
+
+
+@timed("inference.regression_inference")
+@disk_cache
+def regression_inference(
+    data,
+    dep_var,
+    indep_vars: list,
+    time_effects=False,
+    n_replicates=N_REPLICATES,
+    seed=0,
+    workers=None,
+):
+    """
+    Country-block bootstrap confidence intervals and sign-flip permutation
+    p-values of the fixed effects regression slopes (see regression).
+    With year fixed effects the year means are removed once on the full
+    sample, the bootstrap then resamples the demeaned country blocks.
+    Returns one row per slope, named like the rows of regression_summary_table.
+    """
+    df, val_cols = merge_indicators(data, [dep_var] + indep_vars)
+    ind_cols = [val_cols[ind] for ind in indep_vars]
+
+    economy_codes = pd.factorize(df["economy"])[0]
+    groups = [(economy_codes, np.bincount(economy_codes))]
+    if time_effects:
+        year_codes = pd.factorize(df["year"])[0]
+        groups.append((year_codes, np.bincount(year_codes)))
+    values = df[[val_cols[dep_var]] + ind_cols].to_numpy(dtype=float)
+    within = _demean(values, groups)
+    y_w, X_w = within[:, 0], within[:, 1:]
+    n_groups, k = len(groups[0][1]), X_w.shape[1]
+
+    # Per-country cross products, the slopes of any resample are sums of them
+    xtx = np.zeros((n_groups, k, k))
+    np.add.at(xtx, economy_codes, X_w[:, :, None] * X_w[:, None, :])
+    xty = np.zeros((n_groups, k))
+    np.add.at(xty, economy_codes, X_w * y_w[:, None])
+    xtx_inv = np.linalg.inv(xtx.sum(axis=0))
+    beta = xtx_inv @ xty.sum(axis=0)
+
+    # Per-country scores of the residuals of the model without each regressor
+    scores = np.zeros((k, n_groups, k))
+    for j in range(k):
+        others = np.delete(X_w, j, axis=1)
+        if others.shape[1]:
+            resid = y_w - others @ np.linalg.lstsq(others, y_w, rcond=None)[0]
+        else:
+            resid = y_w
+        np.add.at(scores[j], economy_codes, X_w * resid[:, None])
+
+    boot = _run_batches(
+        partial(_bootstrap_slopes, xtx, xty), n_replicates, seed, n_groups, workers
+    )
+    null = _run_batches(
+        partial(_signflip_slopes, xtx_inv, scores),
+        n_replicates,
+        seed + 1,
+        n_groups,
+        workers,
+    )
+    low, high = _percentile_ci(boot)
+    return pd.DataFrame(
+        {
+            "Variables": [name.replace("_", " ").title() for name in ind_cols],
+            "Coefficients": beta,
+            "Bootstrap CI 2.5%": low,
+            "Bootstrap CI 97.5%": high,
+            "Permutation P-value": _permutation_pvalue(null, beta),
+        }
+    )
@@ -0,0 +1,188 @@
+"""
+This module contains the timing instrumentation of the dashboard. The timed
+decorator/context manager records how long data loading, merging, model
+fitting and figure construction take in the current rerun and adds every
+duration to per-stage histograms of the process. report_rerun writes the
+rerun's timings as a JSON line and shows them in the sidebar when debugging,
+and periodically a snapshot of the histograms and percentiles of the process.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import ContextDecorator
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Upper bounds (in ms) of the histogram buckets, the last one is open
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf")]
+# JSON lines of all reruns are appended here when the variable is set
+TIMING_LOG_PATH = os.environ.get("TIMING_LOG")
+SNAPSHOT_INTERVAL_S = 60  # the process histograms are logged at most this often
+
+_lock = threading.Lock()
+_histograms = {}  # stage -> bucket counts
+_samples = {}  # stage -> recent durations (s) for the percentiles
+_last_snapshot = time.monotonic()  # when the histograms were last logged
+# Streamlit runs every session's rerun in its own thread
+_rerun = threading.local()
+
+
+class timed(ContextDecorator):
+    """
+    Measures the time of a stage, as a decorator or a context manager:
+
+        @timed("merge.merge_indicators")
+        def merge_indicators(...): ...
+
+        with timed("data.load"):
+            data = load_indicator_data()
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def _recreate_cm(self):
+        # New object per call so the decorator is safe in several threads
+        return timed(self.stage)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def record(stage, seconds):
+    """Adds a stage duration to the current rerun and to the process histograms."""
+    if hasattr(_rerun, "timings"):
+        _rerun.timings.append((stage, seconds))
+
+    bucket = np.searchsorted(BUCKETS_MS, seconds * 1000)
+    with _lock:
+        if stage not in _histograms:
+            _histograms[stage] = [0] * len(BUCKETS_MS)
+            _samples[stage] = deque(maxlen=1000)
+        _histograms[stage][bucket] += 1
+        _samples[stage].append(seconds)
+
+
+def start_rerun():
+    """Starts collecting the timings of a new rerun (call at the top of a page)."""
+    _rerun.timings = []
+    _rerun.start = time.perf_counter()
+
+
+def rerun_timings():
+    """Returns the (stage, seconds) timings recorded in the current rerun."""
+    return list(getattr(_rerun, "timings", []))
+
+
+def stage_summary():
+    """Returns count, p50, p95 and max (ms) of every stage in this process."""
+    with _lock:
+        samples = {stage: list(values) for stage, values in _samples.items()}
+        histograms = {stage: list(counts) for stage, counts in _histograms.items()}
+
+    rows = []
+    for stage, values in samples.items():
+        ms = np.array(values) * 1000
+        rows.append(
+            {
+                "stage": stage,
+                "count": sum(histograms[stage]),
+                "p50 ms": np.percentile(ms, 50),
+                "p95 ms": np.percentile(ms, 95),
+                "max ms": ms.max(),
+            }
+        )
+    return pd.DataFrame(rows, columns=["stage", "count", "p50 ms", "p95 ms", "max ms"])
+
+
+def histograms():
+    """Returns the bucket counts of every stage (columns are bucket upper bounds in ms)."""
+    with _lock:
+        counts = {stage: list(values) for stage, values in _histograms.items()}
+    return pd.DataFrame.from_dict(
+        counts, orient="index", columns=[str(b) for b in BUCKETS_MS]
+    )
+
+
+def histogram_snapshot():
+    """
+    Returns the histograms and percentiles of every stage in this process as
+    a JSON-serializable dict (one line of the timing log).
+    """
+    counts = histograms()
+    summary = stage_summary().set_index("stage")
+    return {
+        "time": datetime.now().isoformat(timespec="milliseconds"),
+        "pid": os.getpid(),
+        "buckets_ms": list(counts.columns),
+        "histograms": {
+            stage: {
+                "counts": [int(c) for c in counts.loc[stage]],
+                "count": int(summary.loc[stage, "count"]),
+                "p50_ms": float(summary.loc[stage, "p50 ms"]),
+                "p95_ms": float(summary.loc[stage, "p95 ms"]),
+                "max_ms": float(summary.loc[stage, "max ms"]),
+            }
+            for stage in counts.index
+        },
+    }
+
+
+def _log_snapshot():
+    """Appends a histogram snapshot to the timing log if the last one is old enough."""
+    global _last_snapshot
+    now = time.monotonic()
+    with _lock:
+        if now - _last_snapshot < SNAPSHOT_INTERVAL_S:
+            return
+        _last_snapshot = now
+    line = histogram_snapshot()
+    with _lock, open(TIMING_LOG_PATH, "a") as f:
+        f.write(json.dumps(line) + "\n")
+
+
+def report_rerun(page):
+    """
+    Ends the rerun of a page: appends its timings as a JSON line to the timing
+    log (if TIMING_LOG is set), followed every SNAPSHOT_INTERVAL_S by a
+    histogram snapshot of the process, and shows them in the sidebar when the
+    page is opened with ?debug=1 or DASHBOARD_DEBUG=1 is set.
+    """
+    timings = rerun_timings()
+    total = time.perf_counter() - getattr(_rerun, "start", time.perf_counter())
+    record(f"rerun.{page}", total)
+
+    if TIMING_LOG_PATH:
+        line = {
+            "time": datetime.now().isoformat(timespec="milliseconds"),
+            "page": page,
+            "total_s": total,
+            "stages": [{"stage": s, "seconds": t} for s, t in timings],
+        }
+        with _lock, open(TIMING_LOG_PATH, "a") as f:
+            f.write(json.dumps(line) + "\n")
+        _log_snapshot()
+
+    debug = st.query_params.get("debug") == "1" or os.environ.get("DASHBOARD_DEBUG")
+    if debug:
+        with st.sidebar:
+            st.subheader("⏱️ Timings of this rerun")
+            st.caption(f"Total: {total * 1000:.1f} ms")
+            st.dataframe(
+                pd.DataFrame(
+                    [(s, t * 1000) for s, t in timings], columns=["stage", "ms"]
+                ).round(2),
+                hide_index=True,
+            )
+            st.subheader("Process percentiles")
+            st.dataframe(stage_summary().round(2), hide_index=True)
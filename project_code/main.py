@@ -3,22 +3,131 @@ This module is used to execute the data collection and cleaning functions
 prior to running the streamlit for a quicker execution of the dashboard.
 """
 
-from project_code.data_collection import collect_data, ensure_valid_raw_data
-from project_code.data_cleaning import clean_data, split_data, long_format_data
+import threading
+from functools import partial
+from project_code.catalog import indicator_slugs
+from project_code.data_cleaning import add_indicators, build_panel
+from project_code.panel import (
+    PANEL_DIR,
+    Panel,
+    acquire_setup_lock,
+    refresh_setup_lock,
+    release_setup_lock,
+    snapshot_exists,
+)
 
 
-def setup():
-    # Collect raw data from World Bank API
-    collect_data()
+def setup(debug=False):
+    """
+    Collects the raw data and builds a new snapshot of the panel store.
+    Returns False without doing anything if another process is running it.
+    """
+    # One setup at a time over all processes using the data folder
+    if not acquire_setup_lock(PANEL_DIR):
+        print("⚠ Setup is already running in another process.")
+        return False
+    try:
+        _setup(debug)
+    finally:
+        release_setup_lock(PANEL_DIR)
+    return True
+
+
+def _setup(debug=False):
+    # The World Bank API client (wbgapi) is only loaded when data is collected,
+    # not by the dashboard pages importing this module
+    from project_code.data_collection import collect_data, ensure_valid_raw_data
+
+    # Collect raw data from World Bank API, every finished request keeps the
+    # setup lock from going stale
+    collect_data(progress=partial(refresh_setup_lock, PANEL_DIR))
 
     # Check if the data was downloaded correctly if not replace with backup
     ensure_valid_raw_data()
 
     # Clean the collected data by removing low-coverage indicators and countries
-    clean_data()
+    # and write it to the panel store (debug also keeps the intermediate CSVs)
+    build_panel(debug=debug)
+
+
+def update_indicators():
+    """
+    Fetches and processes only the catalog indicators missing from the panel
+    store (e.g. after adding a series to data/indicators.json) instead of a
+    full setup(). Without a panel store it runs the full setup.
+    """
+    if not snapshot_exists(PANEL_DIR):
+        setup()
+        return
+
+    if not acquire_setup_lock(PANEL_DIR):
+        print("⚠ Setup is already running in another process.")
+        return
+    try:
+        _update_indicators()
+    finally:
+        release_setup_lock(PANEL_DIR)
+
+
+def _update_indicators():
+    from project_code.data_collection import load_raw_data, sync_data
+
+    panel_indicators = set(Panel.open(PANEL_DIR).indicators)
+    new_codes = [
+        code for code, slug in indicator_slugs().items() if slug not in panel_indicators
+    ]
+    if not new_codes:
+        print("✔ All catalog indicators are in the panel store.")
+        return
+
+    # The economies already collected, only the never fetched cells are requested
+    economies = load_raw_data().index.get_level_values("economy").unique().tolist()
+    sync_data(
+        economies,
+        max_age_days=None,
+        progress=partial(refresh_setup_lock, PANEL_DIR),
+    )
+
+    added = add_indicators(new_codes)
+    print(f"Added indicators: {added}")
+
+
+class BackgroundSetup:
+    """
+    Runs setup() in a background thread, one run at a time per process (and
+    over processes through the setup lock file), so the dashboard keeps
+    serving (the current snapshot, if any) meanwhile. The new snapshot is
+    published only if the whole setup succeeds.
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+        self.error = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, debug=False):
+        """Starts setup() unless it is already running, returns True if started."""
+        with self._lock:
+            if self.running:
+                return False
+            self.error = None
+            self._thread = threading.Thread(
+                target=self._run, args=(debug,), name="background-setup", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def _run(self, debug):
+        try:
+            setup(debug=debug)
+        except Exception as e:
+            self.error = e
+            print(f"✖ Background setup failed: {e}")
 
-    # Split the cleaned data into separate files per indicator
-    split_data()
 
-    # Convert each cleaned indicator file to long format
-    long_format_data()
+# Shared by all sessions of the dashboard process
+background_setup = BackgroundSetup()
@@ -0,0 +1,543 @@
+"""
+This module contains the panel store - one typed columnar file set holding
+all indicators indexed by (economy, year, indicator) - and the read-only
+Panel object the dashboard pages use to access it. The store is memory-mapped
+read-only, so every worker process on a host shares the same physical pages
+and the indicator columns of every panel are views of them. Rows are sorted
+by year, so the rows of one year are a contiguous slice found in the year
+offset table.
+The store is written as versioned snapshots: each one is built in a staging
+folder and published by atomically replacing the current pointer file, so
+readers never see a half-written store and files already mapped are never
+rewritten.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections.abc import Mapping
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+PANEL_DIR = Path(__file__).parent.parent / "data" / "panel"
+CURRENT_POINTER = "current"  # file naming the current snapshot of the store
+KEEP_SNAPSHOTS = 3  # older snapshots are removed when a new one is published
+# Created exclusively by the process rebuilding the store, so only one
+# process (of all the servers sharing the data folder) rebuilds it at a time
+SETUP_LOCK = ".setup.lock"
+# The holder refreshes the lock as it makes progress (every fetched request
+# and raw data chunk), a lock not refreshed for this long was left by a
+# crashed or hung setup
+STALE_LOCK_S = 10 * 60
+
+
+def resolve_snapshot(path=PANEL_DIR):
+    """
+    Returns the folder of the current snapshot of the panel store at path
+    (path itself for a snapshot folder or a store written before snapshots).
+    """
+    path = Path(path)
+    pointer = path / CURRENT_POINTER
+    if pointer.exists():
+        return path / pointer.read_text().strip()
+    return path
+
+
+def snapshot_exists(path=PANEL_DIR):
+    """Returns True if the panel store at path has a complete snapshot."""
+    return (resolve_snapshot(path) / "indicators.json").exists()
+
+
+def staging_dir(path=PANEL_DIR):
+    """Creates a new staging folder for a snapshot of the panel store at path."""
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    return Path(tempfile.mkdtemp(prefix=".staging-", dir=path))
+
+
+def publish_snapshot(staging, path=PANEL_DIR, keep=KEEP_SNAPSHOTS):
+    """
+    Publishes a staging folder as the current snapshot of the store at path:
+    the folder is renamed to a version and the pointer file replaced
+    atomically. Only the keep newest snapshots are kept. Returns the version.
+    """
+    path = Path(path)
+    # Versions sort by publication time
+    version = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    os.rename(staging, path / version)
+    pointer = path / f".{CURRENT_POINTER}-{os.getpid()}"
+    pointer.write_text(version)
+    os.replace(pointer, path / CURRENT_POINTER)
+
+    # Processes still reading an old snapshot keep their mapped files (where
+    # the OS allows removing them, otherwise they are removed next time)
+    snapshots = sorted(
+        p.name
+        for p in path.iterdir()
+        if p.is_dir() and not p.name.startswith(".") and p.name != version
+    )
+    for old in snapshots[: max(len(snapshots) - keep + 1, 0)]:
+        shutil.rmtree(path / old, ignore_errors=True)
+    print(f"Panel snapshot {version} published in {path}")
+    return version
+
+
+def discard_staging(staging):
+    """Removes a staging folder of a snapshot that failed to build."""
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def acquire_setup_lock(path=PANEL_DIR):
+    """
+    Creates the setup lock file of the store at path with O_EXCL, returns
+    False if another process holds it. A lock not refreshed (see
+    refresh_setup_lock) for STALE_LOCK_S is taken over. Once the lock is held,
+    the staging folders and pointer files left by crashed setups are removed.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    lock = path / SETUP_LOCK
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            stale = time.time() - lock.stat().st_mtime > STALE_LOCK_S
+        except FileNotFoundError:
+            stale = True  # released meanwhile
+        if not stale:
+            return False
+        lock.unlink(missing_ok=True)
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+    with os.fdopen(fd, "w") as f:
+        f.write(f"{os.getpid()} {datetime.now().isoformat()}\n")
+
+    # Nobody else is building, so these were left by crashed setups
+    for leftover in path.glob(".staging-*"):
+        discard_staging(leftover)
+    for leftover in path.glob(f".{CURRENT_POINTER}-*"):
+        leftover.unlink(missing_ok=True)
+    return True
+
+
+def refresh_setup_lock(path=PANEL_DIR):
+    """
+    Marks the setup holding the lock of the store at path as alive by setting
+    the lock file's modification time to now (nothing if there is no lock).
+    """
+    try:
+        os.utime(Path(path) / SETUP_LOCK)
+    except FileNotFoundError:
+        pass
+
+
+def release_setup_lock(path=PANEL_DIR):
+    """Removes the setup lock file of the store at path."""
+    (Path(path) / SETUP_LOCK).unlink(missing_ok=True)
+
+
+def write_panel_store(wide, path=PANEL_DIR, economy_table=None):
+    """
+    Writes a wide DataFrame (economy, year + one column per indicator)
+    to the panel store as memory-mappable NumPy arrays, rows sorted by year
+    and economy. Economies are stored as integer codes into the economies
+    table (code, name, region).
+    economy_table: DataFrame with code, name and region columns of the economies,
+    economies missing from it are named by their code.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    wide = wide.sort_values(["year", "economy"]).reset_index(drop=True)
+    indicators = [c for c in wide.columns if c not in ["economy", "year"]]
+
+    # Fortran order keeps every indicator column contiguous on disk
+    values = np.asfortranarray(wide[indicators].to_numpy(dtype="float64"))
+    np.save(path / "values.npy", values)
+    economy = pd.Categorical(wide["economy"])
+    np.save(path / "economy.npy", economy.codes.astype("int32"))
+    table = _economy_table(economy.categories, economy_table)
+    table.to_csv(path / "economies.csv", index=False)
+    np.save(path / "year.npy", wide["year"].to_numpy(dtype="int64"))
+    with open(path / "indicators.json", "w") as f:
+        json.dump(indicators, f)
+    print(f"Panel store saved to {path}")
+
+
+def create_panel_store(path, economies, years, indicators, economy_table=None):
+    """
+    Creates a panel store with a row for every economy in every year and all
+    values NaN, to be filled in place. economies and years must be sorted, the
+    row of (years[i], economies[j]) is i * len(economies) + j.
+    Returns the values as a writable memory-mapped (row, indicator) array.
+    economy_table: DataFrame with code, name and region columns of the economies.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    n_economies, n_years = len(economies), len(years)
+    np.save(
+        path / "economy.npy", np.tile(np.arange(n_economies, dtype="int32"), n_years)
+    )
+    np.save(path / "year.npy", np.repeat(np.asarray(years, dtype="int64"), n_economies))
+    _economy_table(economies, economy_table).to_csv(path / "economies.csv", index=False)
+    with open(path / "indicators.json", "w") as f:
+        json.dump(list(indicators), f)
+
+    # Fortran order keeps every indicator column contiguous on disk
+    values = np.lib.format.open_memmap(
+        path / "values.npy",
+        mode="w+",
+        dtype="float64",
+        shape=(n_economies * n_years, len(indicators)),
+        fortran_order=True,
+    )
+    values[:] = np.nan
+    return values
+
+
+def _economy_table(codes, economy_table=None):
+    """Returns the code, name and region of the given economy codes, in their order."""
+    table = pd.DataFrame({"code": np.asarray(codes, dtype=object)})
+    if economy_table is None:
+        economy_table = pd.DataFrame(columns=["code", "name", "region"])
+    known = economy_table.drop_duplicates("code").set_index("code")
+    table["name"] = table["code"].map(known["name"]).fillna(table["code"])
+    table["region"] = table["code"].map(known["region"]).fillna("")
+    return table
+
+
+class Panel(Mapping):
+    """
+    Read-only mapping of indicator name -> long DataFrame (economy, year, value)
+    backed by the memory-mapped panel store. The frame of an indicator is
+    built when it is accessed, from a view of its store column (the OS pages
+    in only the parts of the store that are read).
+    A panel can select indicators and economies of a store shared with other
+    panels: columns are the store columns of the indicators and every panel
+    keeps all store rows, so its columns are always views. The rows of the
+    economies left out have the economy code -1, they are masked out by
+    columns(), cube(), the metadata and the frames (the frames of such a
+    panel are copies of the kept rows).
+    The economy column is categorical: integer codes into economy_table.
+    Rows must be sorted by year, the rows of a year are year_slice(year).
+    """
+
+    def __init__(
+        self,
+        values,
+        economy,
+        year,
+        indicators,
+        economy_table=None,
+        columns=None,
+    ):
+        self.values = values
+        if not isinstance(economy, pd.Categorical):
+            economy = pd.Categorical(economy)
+        self.economy = economy
+        # code, name and region of every category of the economy column
+        if economy_table is None:
+            economy_table = _economy_table(economy.categories)
+        self.economy_table = economy_table
+        self.year = year
+        # Year offset table: the rows of years[i] are offsets[i]:offsets[i + 1]
+        if np.any(np.diff(year) < 0):
+            raise ValueError("Panel rows must be sorted by year")
+        self.years, starts = np.unique(year, return_index=True)
+        self._offsets = np.append(starts, len(year))
+        self._year_positions = {int(y): i for i, y in enumerate(self.years)}
+        self.indicators = list(indicators)
+        if columns is None:
+            columns = range(len(self.indicators))
+        # Store column of every indicator
+        self._positions = dict(zip(self.indicators, (int(j) for j in columns)))
+        # Rows of the kept economies, None if all rows are kept
+        kept = np.asarray(economy.codes) >= 0
+        self._kept = None if kept.all() else kept
+        # Results derived from this panel (e.g. correlation tensors)
+        self.cache = {}
+        self._version = None
+        self._metadata = None
+
+    @classmethod
+    def from_frames(cls, data):
+        """Builds an in-memory panel from a dict of long-format indicator DataFrames."""
+        wide = None
+        for ind, df in data.items():
+            val_col = [c for c in df.columns if c not in ["economy", "year"]][0]
+            df = df.rename(columns={val_col: ind})
+            if wide is None:
+                wide = df
+            else:
+                wide = wide.merge(df, on=["economy", "year"], how="outer")
+        wide = wide.sort_values(["year", "economy"]).reset_index(drop=True)
+        indicators = list(data.keys())
+        return cls(
+            values=np.asfortranarray(wide[indicators].to_numpy(dtype="float64")),
+            economy=pd.Categorical(wide["economy"]),
+            year=wide["year"].to_numpy(dtype="int64"),
+            indicators=indicators,
+        )
+
+    @classmethod
+    def open(cls, path=PANEL_DIR):
+        """
+        Opens the current snapshot of the panel store with zero-copy
+        (memory-mapped) reads.
+        """
+        path = resolve_snapshot(path)
+        with open(path / "indicators.json") as f:
+            indicators = json.load(f)
+        values = np.load(path / "values.npy", mmap_mode="r")
+        economy = np.load(path / "economy.npy", mmap_mode="r")
+        year = np.load(path / "year.npy", mmap_mode="r")
+        if (path / "economies.csv").exists():
+            # Without NA parsing, "NA" is the code of Namibia
+            table = pd.read_csv(path / "economies.csv", keep_default_na=False)
+            economy = pd.Categorical.from_codes(economy, categories=table["code"])
+        else:  # store written before the economies table, economy codes as strings
+            table = None
+        if np.any(np.diff(year) < 0):
+            # Store written sorted by economy, sorted by year in memory instead
+            order = np.argsort(year, kind="stable")
+            values = np.asfortranarray(values[order])
+            economy = np.asarray(economy)[order]
+            year = np.asarray(year)[order]
+        return cls(
+            values=values,
+            economy=economy,
+            year=year,
+            indicators=indicators,
+            economy_table=table,
+        )
+
+    @property
+    def version(self):
+        """Content hash of the panel data and labels, identifies the data version."""
+        if self._version is None:
+            h = hashlib.sha256()
+            # Columns of the Fortran-ordered store are hashed without a copy
+            for ind in self.indicators:
+                h.update(np.ascontiguousarray(self.column(ind)).data)
+            h.update(np.ascontiguousarray(self.year).tobytes())
+            h.update(np.ascontiguousarray(self.economy.codes).tobytes())
+            h.update("\n".join(map(str, self.economy.categories)).encode())
+            h.update(json.dumps(self.indicators).encode())
+            self._version = h.hexdigest()[:16]
+        return self._version
+
+    def column(self, indicator):
+        """
+        Returns the values of an indicator in all store rows, a read-only view
+        of its store column (rows of economies left out included, see kept).
+        """
+        return self.values[:, self._positions[indicator]]
+
+    def kept(self, year=None):
+        """
+        Returns a new boolean mask of the rows (of year, if given) whose
+        economy is kept by the panel.
+        """
+        rows = self.rows(year)
+        if self._kept is None:
+            return np.ones(len(self.year[rows]), dtype=bool)
+        return self._kept[rows].copy()
+
+    @property
+    def metadata(self):
+        """
+        Metadata index of the indicators, computed once per panel in one pass
+        over the values: a DataFrame indexed by indicator with the first_year
+        and last_year with data, the count of values and their min and max.
+        """
+        if self._metadata is None:
+            self._metadata = self._build_metadata()
+        return self._metadata[0]
+
+    @property
+    def year_counts(self):
+        """Count of values per year (rows) and indicator (columns) as a DataFrame."""
+        if self._metadata is None:
+            self._metadata = self._build_metadata()
+        return self._metadata[1]
+
+    def _build_metadata(self):
+        """Returns the metadata index and the counts per year of the indicators."""
+        counts = np.zeros((len(self.years), len(self.indicators)), dtype=int)
+        minimum = np.full(len(self.indicators), np.nan)
+        maximum = np.full(len(self.indicators), np.nan)
+        kept = self.kept()
+        for k, ind in enumerate(self.indicators):
+            values = self.column(ind)
+            if len(self.years):
+                # Counts per year are sums over the row slices of the offset table
+                present = ~np.isnan(values) & kept
+                counts[:, k] = np.add.reduceat(present, self._offsets[:-1])
+            # fmin/fmax skip NaN without warning on indicators without data
+            minimum[k] = np.fmin.reduce(values, where=kept, initial=np.nan)
+            maximum[k] = np.fmax.reduce(values, where=kept, initial=np.nan)
+        # First and last year with data, NA for indicators without any
+        year_grid = pd.DataFrame(np.where(counts > 0, self.years[:, None], np.nan))
+        metadata = pd.DataFrame(
+            {
+                "first_year": year_grid.min().to_numpy(),
+                "last_year": year_grid.max().to_numpy(),
+                "count": counts.sum(axis=0),
+                "min": minimum,
+                "max": maximum,
+            },
+            index=pd.Index(self.indicators, name="indicator"),
+        ).astype({"first_year": "Int64", "last_year": "Int64"})
+        year_counts = pd.DataFrame(
+            counts, index=pd.Index(self.years, name="year"), columns=self.indicators
+        )
+        return metadata, year_counts
+
+    def with_economy_labels(self, labels):
+        """
+        Returns a panel sharing the same values but with other economy labels,
+        labels: one unique label per economy of economy_table (e.g. its names).
+        Only the categories are relabelled, the codes, the column selection
+        and the metadata are shared.
+        """
+        panel = Panel(
+            self.values,
+            self.economy.rename_categories(list(labels)),
+            self.year,
+            self.indicators,
+            economy_table=self.economy_table,
+            columns=[self._positions[ind] for ind in self.indicators],
+        )
+        panel._metadata = self._metadata
+        return panel
+
+    def subset(self, indicators, economies):
+        """
+        Returns a panel with only the given indicators and economies (codes of
+        economy_table) over the same store rows and columns (no copy of the
+        values, only the economy codes are rewritten). Returns self if nothing
+        is removed.
+        """
+        keep = np.isin(self.economy_table["code"], list(economies))
+        if keep.all() and list(indicators) == self.indicators:
+            return self
+
+        # Codes of the kept economies are renumbered in the same order, the
+        # rows of the others get -1
+        codes = self.economy.codes
+        new_codes = np.append(np.where(keep, np.cumsum(keep) - 1, -1), -1)
+        economy = pd.Categorical.from_codes(
+            new_codes[codes], categories=self.economy.categories[keep]
+        )
+        return Panel(
+            self.values,
+            economy,
+            self.year,
+            list(indicators),
+            economy_table=self.economy_table[keep].reset_index(drop=True),
+            columns=[self._positions[ind] for ind in indicators],
+        )
+
+    def to_wide(self):
+        """Returns a copy of the panel as a wide DataFrame (economy, year, indicators...)."""
+        # Copied out of the store, so the store files can be rewritten
+        kept = self.kept()
+        wide = pd.DataFrame(
+            {ind: self.column(ind)[kept] for ind in self.indicators},
+            columns=self.indicators,
+        )
+        wide.insert(0, "year", np.asarray(self.year)[kept])
+        wide.insert(0, "economy", np.asarray(self.economy, dtype=object)[kept])
+        return wide
+
+    def year_slice(self, year):
+        """Returns the slice of the rows of a year (an empty slice if it has none)."""
+        i = self._year_positions.get(int(year))
+        if i is None:
+            return slice(0, 0)
+        return slice(int(self._offsets[i]), int(self._offsets[i + 1]))
+
+    def rows(self, year=None):
+        """Returns the slice of the rows of year, or of all rows if year is None."""
+        return slice(None) if year is None else self.year_slice(year)
+
+    def columns(self, indicators, year=None):
+        """
+        Returns the value columns of the given indicators as views of the store
+        and a boolean mask of the rows of kept economies where all of them are
+        present. With a year only the rows of that year are read.
+        """
+        rows = self.rows(year)
+        cols = [self.column(ind)[rows] for ind in indicators]
+        mask = self.kept(year)
+        for col in cols:
+            mask &= ~np.isnan(col)
+        return cols, mask
+
+    def cube(self, indicators=None):
+        """
+        Returns the panel values as a (year, economy, indicator) array with NaN
+        for missing cells, together with the sorted years of the first axis.
+        indicators: Only these indicators (in this order), all if None.
+        """
+        # Year of each row from the offset table (the rows are sorted by year)
+        year_idx = np.repeat(np.arange(len(self.years)), np.diff(self._offsets))
+        kept = self.kept()
+        year_idx, codes = year_idx[kept], self.economy.codes[kept]
+        n_economies = len(self.economy.categories)
+        if indicators is None:
+            indicators = self.indicators
+        cube = np.full((len(self.years), n_economies, len(indicators)), np.nan)
+        for k, ind in enumerate(indicators):
+            values = self.column(ind)
+            cube[year_idx, codes, k] = values if self._kept is None else values[kept]
+        return cube, self.years
+
+    def frame(self, indicator, year=None):
+        """
+        Returns the long frame (economy, year, value) of an indicator in the
+        rows of the kept economies (of year, if given).
+        """
+        rows = self.rows(year)
+        # Built on access and not kept: the year and value columns are
+        # read-only views of the store and the categorical economy column
+        # shares the codes of the panel, so with all economies kept a frame
+        # costs no data copy (otherwise its kept rows are copied)
+        frame = pd.DataFrame(
+            {
+                "economy": self.economy[rows],
+                "year": self.year[rows],
+                indicator: self.column(indicator)[rows],
+            },
+            copy=False,
+        )
+        if self._kept is None:
+            return frame
+        return frame[self.kept(year)].reset_index(drop=True)
+
+    def __getitem__(self, indicator):
+        # Raises KeyError for unknown indicators like a dict would
+        return self.frame(indicator)
+
+    def __contains__(self, indicator):
+        # Without loading the indicator (Mapping would call __getitem__)
+        return indicator in self._positions
+
+    def __iter__(self):
+        return iter(self.indicators)
+
+    def __len__(self):
+        return len(self.indicators)
+
+
+def as_panel(data):
+    """Returns data as a Panel (dicts of DataFrames are combined into one)."""
+    if isinstance(data, Panel):
+        return data
+    return Panel.from_frames(data)
@@ -3,16 +3,32 @@ This module contains function for merging the selected indicators into one
 DataFrame and also selects the value column
 """
 
+import pandas as pd
+from project_code.instrumentation import timed
+from project_code.panel import Panel
 
-def merge_indicators(data, indicators: list):
+
+@timed("merge.merge_indicators")
+def merge_indicators(data, indicators: list, year=None):
     """
     Merges data for indicators provided in a list based on ['economy', 'year'].
+    year: If given, only the rows of that year are read, before any join
+    (for a Panel a slice of the year-sorted rows).
+    For a Panel this is a column selection on the aligned panel matrix
+    (economies stay categorical codes), for a plain dict of DataFrames the
+    indicators are joined.
     """
+    if isinstance(data, Panel):
+        return _select_indicators(data, indicators, year)
+
     df_merged = None
     val_cols = {}
 
     for i, ind in enumerate(indicators):
-        df = data[ind].copy()
+        df = data[ind]
+        if year is not None:
+            df = df[df["year"] == year]
+        df = df.copy()
         # Detect value column (exclude 'economy' and 'year')
         val_col = [c for c in df.columns if c not in ["economy", "year"]][0]
 
@@ -32,3 +48,19 @@ def merge_indicators(data, indicators: list):
     df_merged = df_merged.dropna(subset=list(val_cols.values()))
 
     return df_merged, val_cols
+
+
+def _select_indicators(panel, indicators, year=None):
+    """Selects indicator columns from the panel and keeps rows where all are present."""
+    cols, mask = panel.columns(indicators, year)
+
+    rows = panel.rows(year)
+    df_merged = {"economy": panel.economy[rows][mask], "year": panel.year[rows][mask]}
+    val_cols = {}
+    for i, (ind, col) in enumerate(zip(indicators, cols)):
+        # Same column naming as the joins so callers see identical frames
+        new_col = f"{ind}_{i}"
+        df_merged[new_col] = col[mask]
+        val_cols[ind] = new_col
+
+    return pd.DataFrame(df_merged), val_cols
@@ -1,86 +1,169 @@
 """
 This module contains functions for the visualisation of the indicators
-such as choropleth map, scatterplot, 3D scatterplot
+such as choropleth map (per year or animated over years), scatterplot,
+3D scatterplot
 """
 
-import plotly.express as px
+import threading
+from collections import OrderedDict
+import numpy as np
 import streamlit as st
+from project_code.analysis import correlation_over_time, rolling_correlation
+from project_code.cache import disk_cache
+from project_code.catalog import color_scale, indicator_label
+from project_code.instrumentation import timed
+from project_code.panel import as_panel
 from project_code.utils import merge_indicators
 import pandas as pd
-import pycountry
 
+# plotly is imported by the functions building figures, so pages importing
+# this module do not load it before the first figure is needed
 
-def plot_map(data, indicator, year):
+# Animated figures over this payload show fewer years (a larger frame stride)
+MAX_ANIMATION_BYTES = 2 * 1024**2  # 2 MB
+BYTES_PER_VALUE = 11  # a float64 encoded in the figure JSON (base64)
+# Map figures kept in memory as JSON (a few MB each when animated), older
+# ones are read again from the disk cache
+MAX_CACHED_FIGURES = 8
+
+_figures = OrderedDict()  # (data version, figure, indicator, year) -> JSON
+_figures_lock = threading.Lock()
+
+
+def _cached_figure_json(key, build):
+    """Returns the figure JSON of key from the in-memory LRU, built on a miss."""
+    with _figures_lock:
+        if key in _figures:
+            _figures.move_to_end(key)
+            return _figures[key]
+    figure_json = build()
+    with _figures_lock:
+        _figures[key] = figure_json
+        while len(_figures) > MAX_CACHED_FIGURES:
+            _figures.popitem(last=False)
+    return figure_json
+
+
+def map_color_scale(indicator):
     """
-    Creates a choropleth map for a given indicator and year.
+    Returns the choropleth colour scale suiting the indicator, from the catalog:
+    red for high values where high is bad (such as mortality), red for low
+    values where low is bad (such as life expectancy), neutral indicators blue.
     """
-    # Get the data for the selected indicator
-    df = data[indicator]
-
-    # Detect the value column (only non economy/year column)
-    value_col = [col for col in df.columns if col not in ["economy", "year"]][0]
+    return color_scale(indicator)
 
-    # Filter for selected year
-    df_year = df[df["year"] == year].copy()
 
-    # Keep country codes to load the map and create column with whole country name for display
-    code_to_country = {}
-    for c in pycountry.countries:
-        if hasattr(c, "alpha_3"):
-            code_to_country[c.alpha_3] = c.name
+def map_frame(data, indicator, year=None):
+    """
+    Returns the frame (economy, year, value, country) of an indicator for
+    the map, only the rows of year (a slice of the year-sorted panel) if given.
+    """
+    panel = as_panel(data)
+    df = panel.frame(indicator, year)
 
-    df_year["country"] = (
-        df_year["economy"].map(code_to_country).fillna(df_year["economy"])
+    # Keep country codes to load the map and create column with whole country
+    # name for display (a relabel of the economy categories, no string mapping)
+    df["country"] = df["economy"].cat.rename_categories(
+        list(panel.economy_table["name"])
     )
+    return df
 
-    # Indicators where HIGH is BAD - use scale (red=high, green=low) such as mortality
-    # Indicators where LOW is BAD - use (red = low) such as life expectancy
-    # Neutral indicators use blue
-    bad_indicators = [
-        "child_mortality",
-        "pm25_pollution",
-        "co2_per_capita",
-        "ghg_per_capita",
-        "carbon_intensity",
-    ]
-    good_indicators = ["forest_area", "life_expectancy", "renewable_energy"]
-    # Choose color scale based on indicator type
-    if indicator in bad_indicators:
-        color_scale = "RdYlGn_r"
-    elif indicator in good_indicators:
-        color_scale = "RdYlGn"
-    else:
-        color_scale = "Viridis"
+
+@disk_cache
+def _map_figure_json(data, indicator, year):
+    """Builds the choropleth map of an indicator and year as figure JSON."""
+    import plotly.express as px
+
+    df_year = map_frame(data, indicator, year)
 
     # Create map
     plot_map = px.choropleth(
         df_year,
         locations="economy",
-        color=value_col,  # makes color shade based on indicator values
+        color=indicator,  # makes color shade based on indicator values
+        hover_name="country",
+        color_continuous_scale=map_color_scale(indicator),
+        projection="robinson",
+        labels={indicator: indicator_label(indicator, unit=True)},
+        title=f"{indicator_label(indicator)} — {year}",
+    )
+
+    plot_map.update_layout(margin={"r": 0, "t": 50, "l": 0, "b": 0})
+    return plot_map.to_json()
+
+
+@disk_cache
+def _animated_map_json(data, indicator):
+    """Builds the choropleth map of an indicator with one frame per year as JSON."""
+    import plotly.express as px
+
+    df = map_frame(data, indicator)
+    metadata = as_panel(data).metadata.loc[indicator]
+
+    # Same colour range in every year so the frames can be compared
+    plot_map = px.choropleth(
+        df,
+        locations="economy",
+        color=indicator,
         hover_name="country",
-        color_continuous_scale=color_scale,
+        animation_frame="year",
+        range_color=(metadata["min"], metadata["max"]),
+        color_continuous_scale=map_color_scale(indicator),
         projection="robinson",
-        title=f"{indicator.replace('_',' ').title()} — {year}",
+        labels={indicator: indicator_label(indicator, unit=True)},
+        title=f"{indicator_label(indicator)} (animated)",
     )
 
     plot_map.update_layout(margin={"r": 0, "t": 50, "l": 0, "b": 0})
-    return plot_map
+    return plot_map.to_json()
+
+
+@timed("figure.plot_map")
+def plot_map(data, indicator, year):
+    """
+    Creates a choropleth map for a given indicator and year. The figure JSON
+    of the last few maps is kept in memory (all of them on disk) so moving the
+    year slider back to a year only deserializes the figure.
+    """
+    import plotly.io as pio
+
+    panel = as_panel(data)
+    key = (panel.version, "map_figure", indicator, year)
+    return pio.from_json(
+        _cached_figure_json(key, lambda: _map_figure_json(panel, indicator, year))
+    )
+
+
+@timed("figure.animated_map")
+def animated_map(data, indicator):
+    """
+    Creates a choropleth map with one frame per year, so the years are
+    played and scrubbed in the browser without rerunning the page.
+    """
+    import plotly.io as pio
+
+    panel = as_panel(data)
+    key = (panel.version, "animated_map", indicator, None)
+    return pio.from_json(
+        _cached_figure_json(key, lambda: _animated_map_json(panel, indicator))
+    )
 
 
+@timed("figure.correlation_scatterplot")
+@disk_cache
 def correlation_scatterplot(data, ind_x, ind_y, year):
     """
     Creates year-by-year scatterplots for two indicators across all years.
     """
-    # Merge the two indicators
-    df, val_cols = merge_indicators(data, [ind_x, ind_y])
+    import plotly.express as px
+
+    # Merge the two indicators (only the rows of the year are read)
+    df, val_cols = merge_indicators(data, [ind_x, ind_y], year=year)
 
     # Detect value columns
     val_x = val_cols[ind_x]
     val_y = val_cols[ind_y]
 
-    # Create a temporary DataFrame for the year
-    df = df[df["year"] == year]
-
     # Plot
     fig = px.scatter(
         df,
@@ -89,16 +172,17 @@ def correlation_scatterplot(data, ind_x, ind_y, year):
         hover_name="economy",  # show country names on hover
         trendline="ols",  # ordinary least squares regression line
         trendline_color_override="orange",
-        title=f"{ind_x.replace('_', ' ').title()} vs {ind_y.replace('_', ' ').title()} ({year})",
+        title=f"{indicator_label(ind_x)} vs {indicator_label(ind_y)} ({year})",
         labels={
-            val_x: ind_x.replace("_", " ").title(),
-            val_y: ind_y.replace("_", " ").title(),
+            val_x: indicator_label(ind_x, unit=True),
+            val_y: indicator_label(ind_y, unit=True),
         },
     )
 
     return fig
 
 
+@timed("figure.scatterplot_3d")
 def scatterplot_3d(data, ind_x, ind_y, ind_z, year):
     """
     Creates a 3D scatterplot for a selected year from separate long-format DataFrames.
@@ -108,16 +192,16 @@ def scatterplot_3d(data, ind_x, ind_y, ind_z, year):
     - x_indicator, y_indicator, z_indicator: keys in `data` dict
     - year: int
     """
-    # Merge the three indicators
-    df, val_cols = merge_indicators(data, [ind_x, ind_y, ind_z])
+    import plotly.express as px
+
+    # Merge the three indicators for the selected year
+    temp, val_cols = merge_indicators(data, [ind_x, ind_y, ind_z], year=year)
 
     # Detect value columns
     val_x = val_cols[ind_x]
     val_y = val_cols[ind_y]
     val_z = val_cols[ind_z]
 
-    # Filter for selected year
-    temp = df[df["year"] == year]
     if temp.empty:
         st.warning(f"No data available for {year} with selected indicators.")
 
@@ -131,69 +215,278 @@ def scatterplot_3d(data, ind_x, ind_y, ind_z, year):
         hover_name="economy",
         color=val_z,
         labels={
-            val_x: ind_x.replace("_", " ").title(),
-            val_y: ind_y.replace("_", " ").title(),
-            val_z: ind_z.replace("_", " ").title(),
+            val_x: indicator_label(ind_x, unit=True),
+            val_y: indicator_label(ind_y, unit=True),
+            val_z: indicator_label(ind_z, unit=True),
         },
         title=(
-            f"{ind_x.replace('_', ' ').title()} vs {ind_y.replace('_', ' ').title()}"
-            f" vs {ind_z.replace('_', ' ').title()} ({year})"
+            f"{indicator_label(ind_x)} vs {indicator_label(ind_y)}"
+            f" vs {indicator_label(ind_z)} ({year})"
         ),
     )
     return fig
 
 
-def animated_scatter(data, ind_x, ind_y):
+def frame_trendlines(x, y, frame_codes, n_frames):
+    """
+    Fits the OLS trendline of y on x of every frame in one vectorized pass.
+    Returns per-frame arrays of the intercept, slope, R-squared and the
+    smallest and largest x (the ends of the drawn line).
+    """
+    n = np.bincount(frame_codes, minlength=n_frames)
+    s_x = np.bincount(frame_codes, weights=x, minlength=n_frames)
+    s_y = np.bincount(frame_codes, weights=y, minlength=n_frames)
+    s_xx = np.bincount(frame_codes, weights=x * x, minlength=n_frames)
+    s_yy = np.bincount(frame_codes, weights=y * y, minlength=n_frames)
+    s_xy = np.bincount(frame_codes, weights=x * y, minlength=n_frames)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        var_x = n * s_xx - s_x**2
+        var_y = n * s_yy - s_y**2
+        cov = n * s_xy - s_x * s_y
+        slope = cov / var_x
+        intercept = (s_y - slope * s_x) / n
+        rsquared = cov**2 / (var_x * var_y)
+
+    x_min = np.full(n_frames, np.nan)
+    x_max = np.full(n_frames, np.nan)
+    np.fmin.at(x_min, frame_codes, x)
+    np.fmax.at(x_max, frame_codes, x)
+    return intercept, slope, rsquared, x_min, x_max
+
+
+@timed("figure.animated_scatter")
+@disk_cache
+def animated_scatter(data, ind_x, ind_y, stride=1, max_bytes=MAX_ANIMATION_BYTES):
     """
     Creates an animated scatterplot using two indicators across years.
+    The per-year trendlines are fitted in NumPy and every frame carries the
+    coordinates of all points, so any frame can be shown after any other
+    (countries keep their position in the point arrays, so the names are sent
+    once).
+    stride: show every stride-th year (the last year is always shown).
+    max_bytes: payload budget, the stride is increased until the frames fit it.
     """
+    import plotly.graph_objects as go
+
     # Merge the two indicators
     df, val_cols = merge_indicators(data, [ind_x, ind_y])
 
     # Detect value columns
     val_x = val_cols[ind_x]
     val_y = val_cols[ind_y]
+    label_x = indicator_label(ind_x)
+    label_y = indicator_label(ind_y)
+    if df.empty:
+        return go.Figure(layout={"title": f"{label_x} vs {label_y} (no data)"})
+
+    # Grid of years x countries, NaN where a country has no point in a year
+    economy_codes, economies = pd.factorize(df["economy"])
+    year_codes, years = pd.factorize(df["year"], sort=True)
+    x = df[val_x].to_numpy(dtype=float)
+    y = df[val_y].to_numpy(dtype=float)
+    grid_x = np.full((len(years), len(economies)), np.nan)
+    grid_y = np.full((len(years), len(economies)), np.nan)
+    grid_x[year_codes, economy_codes] = x
+    grid_y[year_codes, economy_codes] = y
+    intercept, slope, rsquared, x_min, x_max = frame_trendlines(
+        x, y, year_codes, len(years)
+    )
 
-    # Create animated scatterplot
-    fig = px.scatter(
-        df,
-        x=val_x,
-        y=val_y,
-        animation_frame="year",
-        hover_name="economy",
-        trendline="ols",  # ordinary least squares regression line
-        trendline_color_override="orange",
-        labels={
-            val_x: ind_x.replace("_", " ").title(),
-            val_y: ind_y.replace("_", " ").title(),
+    # Thin out the years until the point arrays of the frames fit the budget
+    frame_bytes = 2 * len(economies) * BYTES_PER_VALUE
+    stride = max(stride, int(np.ceil(len(years) * frame_bytes / max_bytes)), 1)
+    shown = list(range(len(years) - 1, -1, -stride))[::-1]
+
+    def trendline(t):
+        line_x = np.array([x_min[t], x_max[t]])
+        return {
+            "x": line_x,
+            "y": intercept[t] + slope[t] * line_x,
+            "hovertemplate": (
+                f"<b>OLS trendline</b><br>{label_y} = {slope[t]:.4g} * {label_x}"
+                f" + {intercept[t]:.4g}<br>R<sup>2</sup>={rsquared[t]:.4f}<extra></extra>"
+            ),
+        }
+
+    first = shown[0]
+    fig = go.Figure(
+        data=[
+            go.Scatter(
+                x=grid_x[first],
+                y=grid_y[first],
+                mode="markers",
+                hovertext=np.asarray(economies, dtype=object),
+                hovertemplate=(
+                    f"<b>%{{hovertext}}</b><br><br>{label_x}=%{{x}}<br>"
+                    f"{label_y}=%{{y}}<extra></extra>"
+                ),
+                marker={"color": "#636efa"},
+                showlegend=False,
+            ),
+            go.Scatter(
+                mode="lines",
+                line={"color": "orange"},
+                showlegend=False,
+                **trendline(first),
+            ),
+        ]
+    )
+
+    fig.frames = [
+        go.Frame(
+            name=str(years[t]),
+            data=[go.Scatter(x=grid_x[t], y=grid_y[t]), go.Scatter(**trendline(t))],
+            traces=[0, 1],
+        )
+        for t in shown
+    ]
+
+    # Fixed axes over all years so the frames can be compared
+    def axis_range(values):
+        low, high = np.nanmin(values), np.nanmax(values)
+        pad = (high - low) * 0.05 or 1
+        return [low - pad, high + pad]
+
+    animation = {
+        "frame": {"duration": 500, "redraw": False},
+        "transition": {"duration": 300},
+        "mode": "immediate",
+    }
+    fig.update_layout(
+        title=f"{label_x} vs {label_y} (animated)",
+        xaxis={
+            "title": {"text": indicator_label(ind_x, unit=True)},
+            "range": axis_range(x),
+        },
+        yaxis={
+            "title": {"text": indicator_label(ind_y, unit=True)},
+            "range": axis_range(y),
         },
-        title=f"{ind_x.replace('_',' ').title()} vs {ind_y.replace('_',' ').title()} (animated)",
+        margin=dict(l=0, r=0, t=50, b=0),
+        updatemenus=[
+            {
+                "type": "buttons",
+                "direction": "left",
+                "showactive": False,
+                "x": 0.1,
+                "y": 0,
+                "xanchor": "right",
+                "yanchor": "top",
+                "pad": {"r": 10, "t": 70},
+                "buttons": [
+                    {
+                        "label": "&#9654;",
+                        "method": "animate",
+                        "args": [None, {**animation, "fromcurrent": True}],
+                    },
+                    {
+                        "label": "&#9724;",
+                        "method": "animate",
+                        "args": [[None], {**animation, "frame": {"duration": 0}}],
+                    },
+                ],
+            }
+        ],
+        sliders=[
+            {
+                "active": 0,
+                "x": 0.1,
+                "y": 0,
+                "len": 0.9,
+                "xanchor": "left",
+                "yanchor": "top",
+                "pad": {"b": 10, "t": 60},
+                "currentvalue": {"prefix": "year="},
+                "steps": [
+                    {
+                        "label": str(years[t]),
+                        "method": "animate",
+                        "args": [[str(years[t])], animation],
+                    }
+                    for t in shown
+                ],
+            }
+        ],
     )
-    fig.update_layout(margin=dict(l=0, r=0, t=50, b=0))
 
     return fig
 
 
+@timed("figure.correlation_over_time_chart")
+def correlation_over_time_chart(
+    data, ind_x, ind_y, window=1, countries=(), country_window=5
+):
+    """
+    Creates a line chart of the cross-country correlation of two indicators
+    per year (or per window of years), with the rolling correlation within
+    each of the given countries (windows of country_window years).
+    """
+    import plotly.graph_objects as go
+
+    label_x = indicator_label(ind_x)
+    label_y = indicator_label(ind_y)
+    series = correlation_over_time(data, ind_x, ind_y, window=window)
+    name = "All countries" if window == 1 else f"All countries ({window}-year windows)"
+
+    fig = go.Figure(
+        go.Scatter(
+            x=series["year"],
+            y=series["correlation"],
+            mode="lines+markers",
+            name=name,
+            customdata=series["observations"],
+            hovertemplate="%{x}: %{y:.2f} (%{customdata} observations)",
+        )
+    )
+    if countries:
+        rolling = rolling_correlation(data, ind_x, ind_y, window=country_window)
+        for country in countries:
+            fig.add_trace(
+                go.Scatter(
+                    x=rolling.index,
+                    y=rolling[country],
+                    mode="lines",
+                    line={"dash": "dash"},
+                    name=f"{country} ({country_window}-year windows)",
+                )
+            )
+
+    fig.update_layout(
+        title=f"Correlation of {label_x} and {label_y} over time",
+        xaxis={"title": {"text": "Year"}},
+        yaxis={"title": {"text": "Correlation"}, "range": [-1.05, 1.05]},
+        margin=dict(l=0, r=0, t=50, b=0),
+    )
+    return fig
+
+
+@timed("figure.regression_summary_table")
 def regression_summary_table(result):
     """
-    Returns a cleaned DataFrame with only main coefficients (exclude country dummies),
+    Returns a cleaned DataFrame with only main coefficients (exclude country dummies
+    of statsmodels results, fixed effects results contain only the slopes),
     rounded for easier reading and highlights significance.
+    The tidy table of regression_batch is rounded the same way.
     """
-    df = ~result.params.index.str.startswith("C(economy)")
-
-    summary_df = pd.DataFrame(
-        {
-            "Variables": [
-                name.replace("_", " ").title() for name in result.params.index[df]
-            ],
-            "Coefficients": result.params[df].values,
-            "Std. Error": result.bse[df].values,
-            "t-value": result.tvalues[df].values,
-            "P-value": result.pvalues[df].values,
-            "CI 2.5%": result.conf_int()[df][0].values,
-            "CI 97.5%": result.conf_int()[df][1].values,
-        }
-    )
+    if isinstance(result, pd.DataFrame):
+        summary_df = result
+    else:
+        df = ~result.params.index.str.startswith("C(economy)")
+
+        summary_df = pd.DataFrame(
+            {
+                "Variables": [
+                    name.replace("_", " ").title() for name in result.params.index[df]
+                ],
+                "Coefficients": result.params[df].values,
+                "Std. Error": result.bse[df].values,
+                "t-value": result.tvalues[df].values,
+                "P-value": result.pvalues[df].values,
+                "CI 2.5%": result.conf_int()[df][0].values,
+                "CI 97.5%": result.conf_int()[df][1].values,
+            }
+        )
 
     # Round numbers
     summary_df = summary_df.round(
@@ -0,0 +1,46 @@
+"""
+A local stand-in for the wbgapi module with the economy.list() and
+data.DataFrame() interface used by data_collection. Values are generated
+from the (series, economy, year) of the cell, every data request is recorded
+and requests of the series in `failing` raise a ConnectionError.
+"""
+
+import threading
+from types import SimpleNamespace
+import pandas as pd
+
+
+class FakeWorldBank:
+    def __init__(self, economies, failing=()):
+        self.economies = list(economies)
+        self.failing = set(failing)
+        self.requests = []
+        self._lock = threading.Lock()
+        self.economy = SimpleNamespace(list=self._economy_list)
+        self.data = SimpleNamespace(DataFrame=self._data_frame)
+
+    @staticmethod
+    def value(series, economy, year):
+        """The value the fake returns for a cell."""
+        return sum(map(ord, series + economy)) + year / 10000
+
+    def _economy_list(self):
+        return [
+            {"id": e, "value": f"{e} name", "region": "", "aggregate": False}
+            for e in self.economies
+        ]
+
+    def _data_frame(self, series, economy, time, index=None, columns=None):
+        series, economy, years = list(series), list(economy), list(time)
+        with self._lock:
+            self.requests.append((tuple(series), tuple(economy), tuple(years)))
+        if self.failing.intersection(series):
+            raise ConnectionError(f"{series} failed")
+        rows = pd.MultiIndex.from_product(
+            [economy, series], names=["economy", "series"]
+        )
+        return pd.DataFrame(
+            [[self.value(s, e, y) for y in years] for e, s in rows],
+            index=rows,
+            columns=[f"YR{y}" for y in years],
+        )
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+import pytest
+import statsmodels.formula.api as smf
+from project_code import cache
+from project_code.analysis import (
+    correlation_over_time,
+    correlation_tensor,
+    fixed_effects_ols,
+    partial_correlation_tensor,
+    rolling_correlation,
+)
+from project_code.panel import Panel
+
+
+@pytest.fixture(autouse=True)
+def no_disk_cache(monkeypatch):
+    monkeypatch.setattr(cache, "ENABLED", False)
+
+
+# One economy where y is constant in 2000-2002 and x in 2003-2005
+YEARS = list(range(2000, 2006))
+X = [1, 2, 3, 6.2, 6.2, 6.2]
+Y = [6.2, 6.2, 6.2, 1, 2, 4]
+
+
+def constant_series_panel():
+    frames = {
+        "x": pd.DataFrame({"economy": "A", "year": YEARS, "x": X}),
+        "y": pd.DataFrame({"economy": "A", "year": YEARS, "y": Y}),
+    }
+    return Panel.from_frames(frames)
+
+
+def test_rolling_correlation_of_constant_series_is_nan():
+    corr = rolling_correlation(constant_series_panel(), "x", "y", window=3)["A"]
+    assert np.isnan(corr[2002]) and np.isnan(corr[2005])
+    # The windows in between are not constant
+    for t in (3, 4):
+        expected = np.corrcoef(X[t - 2 : t + 1], Y[t - 2 : t + 1])[0, 1]
+        assert abs(corr[YEARS[t]] - expected) < 1e-12
+
+
+def test_correlation_over_time_of_constant_series_is_nan():
+    series = correlation_over_time(constant_series_panel(), "x", "y", window=3)
+    corr = series.set_index("year")["correlation"]
+    assert np.isnan(corr[2002]) and np.isnan(corr[2005])
+
+
+def synthetic_panel_data(seed=0, n_economies=40, n_years=20):
+    """Unbalanced panel with country effects, a trend and about 20% missing rows."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "economy": np.repeat([f"E{i:02d}" for i in range(n_economies)], n_years),
+            "year": np.tile(range(2000, 2000 + n_years), n_economies),
+        }
+    )
+    effect = np.repeat(rng.normal(0, 3, n_economies), n_years)
+    trend = 0.1 * (df["year"] - 2000)
+    df["x1"] = rng.normal(size=len(df)) + effect + trend
+    df["x2"] = rng.normal(size=len(df))
+    df["y"] = 1 + 0.5 * df["x1"] - 2 * df["x2"] + effect + 2 * trend
+    df["y"] += rng.normal(size=len(df))
+    return df.sample(frac=0.8, random_state=seed).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("clustered", [False, True])
+def test_fixed_effects_match_dummy_regression(clustered):
+    df = synthetic_panel_data()
+    result = fixed_effects_ols(
+        df["y"], df[["x1", "x2"]], df["economy"], clustered=clustered
+    )
+    model = smf.ols("y ~ x1 + x2 + C(economy)", df)
+    if clustered:
+        groups = pd.factorize(df["economy"])[0]
+        expected = model.fit(cov_type="cluster", cov_kwds={"groups": groups})
+    else:
+        expected = model.fit()
+
+    slopes = ["x1", "x2"]
+    for name in ["params", "bse", "pvalues"]:
+        np.testing.assert_allclose(
+            getattr(result, name), getattr(expected, name)[slopes], rtol=0, atol=1e-14
+        )
+    np.testing.assert_allclose(
+        result.conf_int(), expected.conf_int().loc[slopes], rtol=0, atol=1e-14
+    )
+    assert abs(result.rsquared - expected.rsquared) < 1e-14
+    assert abs(result.rsquared_adj - expected.rsquared_adj) < 1e-14
+
+
+def test_two_way_fixed_effects_match_dummy_regression():
+    df = synthetic_panel_data()
+    result = fixed_effects_ols(df["y"], df[["x1", "x2"]], df["economy"], df["year"])
+    expected = smf.ols("y ~ x1 + x2 + C(economy) + C(year)", df).fit()
+    # The alternating projections stop at a relative change of 1e-10
+    np.testing.assert_allclose(
+        result.params, expected.params[["x1", "x2"]], rtol=0, atol=1e-10
+    )
+    np.testing.assert_allclose(
+        result.bse, expected.bse[["x1", "x2"]], rtol=0, atol=1e-10
+    )
+
+
+def tensor_panel(seed=0):
+    """Correlated indicators of very different scales with about 15% missing values."""
+    rng = np.random.default_rng(seed)
+    df = synthetic_panel_data(seed)
+    values = rng.normal(size=(len(df), 4)) @ rng.normal(size=(4, 4))
+    values *= [1, 100, 1e-3, 1e5]
+    values[rng.random(values.shape) < 0.15] = np.nan
+    frames = {
+        name: df[["economy", "year"]].assign(**{name: values[:, i]})
+        for i, name in enumerate("abcd")
+    }
+    return Panel.from_frames(frames)
+
+
+def test_correlation_tensor_matches_corrcoef():
+    panel = tensor_panel()
+    corr, years = correlation_tensor(panel)
+    for t, year in enumerate(years):
+        values = panel.values[panel.year == year]
+        for i in range(4):
+            for j in range(4):
+                rows = ~np.isnan(values[:, [i, j]]).any(axis=1)
+                expected = np.corrcoef(values[rows, i], values[rows, j])[0, 1]
+                assert abs(corr[t, i, j] - expected) < 1e-14
+
+
+def test_partial_correlation_tensor_matches_corrcoef():
+    panel = tensor_panel()
+    partial, years = partial_correlation_tensor(panel, "d")
+    for t, year in enumerate(years):
+        values = panel.values[panel.year == year]
+        for i in range(3):
+            for j in range(3):
+                if i == j:
+                    continue
+                triple = values[:, [i, j, 3]]
+                triple = triple[~np.isnan(triple).any(axis=1)]
+                precision = np.linalg.inv(np.corrcoef(triple.T))
+                expected = -precision[0, 1] / np.sqrt(precision[0, 0] * precision[1, 1])
+                assert abs(partial[t, i, j] - expected) < 1e-14
@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+from fake_wbgapi import FakeWorldBank
+from project_code import data_collection
+
+ECONOMIES = ["AAA", "BBB", "CCC"]
+INDICATORS = ["NY.GDP.PCAP.CD", "SP.DYN.LE00.IN"]
+
+
+@pytest.fixture
+def sync(tmp_path, monkeypatch):
+    """sync_data of ECONOMIES and INDICATORS into a temporary raw store and log."""
+    # Failed requests are retried without waiting
+    monkeypatch.setattr(data_collection.time, "sleep", lambda seconds: None)
+    raw_path = tmp_path / "raw.csv"
+
+    def sync(client, years, **kwargs):
+        failed = data_collection.sync_data(
+            ECONOMIES,
+            INDICATORS,
+            years,
+            client=client,
+            raw_path=raw_path,
+            log_path=tmp_path / "log.csv",
+            **kwargs,
+        )
+        return failed, data_collection.load_raw_data(raw_path)
+
+    return sync
+
+
+def expected_raw(years):
+    rows = pd.MultiIndex.from_product(
+        [ECONOMIES, INDICATORS], names=["economy", "series"]
+    )
+    return pd.DataFrame(
+        [[FakeWorldBank.value(s, e, y) for y in years] for e, s in rows],
+        index=rows,
+        columns=[f"YR{y}" for y in years],
+    )
+
+
+def test_only_failed_requests_are_refetched(sync):
+    years = range(2000, 2005)
+    failed, _ = sync(FakeWorldBank(ECONOMIES, failing=[INDICATORS[1]]), years)
+    assert {series for series, _, _ in failed} == {INDICATORS[1]}
+
+    client = FakeWorldBank(ECONOMIES)
+    failed_again, raw = sync(client, years)
+    assert failed_again == []
+    assert sorted(client.requests) == sorted(
+        ((series,), tuple(economies), tuple(request_years))
+        for series, economies, request_years in failed
+    )
+    pd.testing.assert_frame_equal(raw, expected_raw(years))
+
+
+def test_only_new_years_are_requested(sync):
+    sync(FakeWorldBank(ECONOMIES), range(2000, 2005))
+
+    client = FakeWorldBank(ECONOMIES)
+    _, raw = sync(client, range(2000, 2008))
+    assert client.requests
+    assert {years for _, _, years in client.requests} == {(2005, 2006, 2007)}
+    pd.testing.assert_frame_equal(raw, expected_raw(range(2000, 2008)))
+
+
+def test_progress_is_reported_for_every_request(sync):
+    calls = []
+    client = FakeWorldBank(ECONOMIES, failing=[INDICATORS[1]])
+    sync(client, range(2000, 2005), progress=lambda: calls.append(None))
+    # One request per indicator, the failed one is reported too
+    assert len(calls) == len(INDICATORS)
@@ -0,0 +1,12 @@
+import statistics
+import pytest
+from benchmarks.import_time import BUDGET_S, DEFERRED, PAGES, cold_import, page_imports
+
+
+@pytest.mark.parametrize("page", PAGES, ids=lambda page: page.name)
+def test_page_imports_within_budget(page):
+    code = page_imports(page)
+    runs = [cold_import(code) for _ in range(3)]
+    assert statistics.median(seconds for seconds, _, _ in runs) < BUDGET_S
+    modules = runs[0][1]
+    assert [m for m in DEFERRED if m in modules] == []
@@ -0,0 +1,36 @@
+import os
+import time
+from project_code.panel import (
+    SETUP_LOCK,
+    STALE_LOCK_S,
+    acquire_setup_lock,
+    refresh_setup_lock,
+    release_setup_lock,
+)
+
+
+def age_lock(path, seconds):
+    modified = time.time() - seconds
+    os.utime(path / SETUP_LOCK, (modified, modified))
+
+
+def test_refreshed_setup_lock_is_not_taken_over(tmp_path):
+    assert acquire_setup_lock(tmp_path)
+    assert not acquire_setup_lock(tmp_path)
+
+    # A long setup that keeps refreshing the lock keeps it
+    age_lock(tmp_path, STALE_LOCK_S + 60)
+    refresh_setup_lock(tmp_path)
+    assert not acquire_setup_lock(tmp_path)
+
+    release_setup_lock(tmp_path)
+    assert acquire_setup_lock(tmp_path)
+
+
+def test_setup_lock_not_refreshed_is_taken_over(tmp_path):
+    assert acquire_setup_lock(tmp_path)
+    (tmp_path / ".staging-crashed").mkdir()
+    age_lock(tmp_path, STALE_LOCK_S + 60)
+
+    assert acquire_setup_lock(tmp_path)
+    assert not (tmp_path / ".staging-crashed").exists()